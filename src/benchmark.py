@@ -0,0 +1,50 @@
+''' Benchmark gcx decoders '''
+import os
+from timeit import default_timer as timer
+
+from gcl_decompile import GclDecomp
+from gcx import GcxData
+from decode_engine import DecodeEngine, decode, decode_recursive
+
+class Benchmark():
+    ''' Compare iterative and recursive decoding on the deepest procedures '''
+
+    def __init__(self, count=10, repeat=20) -> None:
+
+        self.count = count
+        self.repeat = repeat
+
+    def benchmark(self, mgs_path):
+        ''' Benchmark decoders on the deepest procedures of stage directory '''
+
+        procedures = []
+        for subdir, _dirs, files in os.walk( os.path.join( mgs_path, 'stage' ) ):
+            for file in files:
+                if file.endswith( '.gcx' ):
+                    gcx_file = os.path.join( subdir, file )
+                    decomp = GclDecomp( GcxData( gcx_file ) )
+                    for proc in decomp.read_procedures():
+                        decomp.gcx.offset = proc['data_offset']
+                        engine = DecodeEngine( decomp.decode_node )
+                        engine.run()
+                        procedures.append( ( engine.max_depth, gcx_file, proc, decomp ) )
+
+        procedures.sort( key=lambda proc: proc[0], reverse=True )
+        print( 'depth  iterative  recursive  procedure' )
+        for depth, gcx_file, proc, decomp in procedures[:self.count]:
+            iterative = self.elapsed( decomp, proc, decode )
+            try:
+                recursive = '%7.2fms' % ( self.elapsed( decomp, proc, decode_recursive ) * 1000 )
+            except RecursionError:
+                recursive = '    error'
+            print( '%5d  %7.2fms  %s  %s:%04X' % ( depth, iterative * 1000, recursive, gcx_file, proc['id'] ) )
+
+    def elapsed(self, decomp, proc, decoder):
+        ''' Return average decoding time of a procedure '''
+
+        start_time = timer()
+        for _ in range( self.repeat ):
+            decomp.gcx.offset = proc['data_offset']
+            decomp.commands_stack = []
+            decoder( decomp.decode_node )
+        return ( timer() - start_time ) / self.repeat
@@ -0,0 +1,126 @@
+''' Decompiled data cache '''
+import os
+import sys
+import json
+import pickle
+import hashlib
+
+def tool_version() -> str:
+    ''' Return hash of the tool sources, decompiled trees may change with any of them '''
+
+    version = hashlib.sha256()
+    tool_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    for file in sorted( os.listdir( tool_dir ) ):
+        if file.endswith( '.py' ):
+            with open( os.path.join( tool_dir, file ), 'rb' ) as f:
+                version.update( file.encode() )
+                version.update( f.read() )
+    return version.hexdigest()
+
+class DecompCache():
+    ''' Decompiled data stored by hash of input data, tool version and symbols.
+
+        Entries are pickled files, the least recently used ones (by file
+        modification time, updated when loaded) are removed when the cache
+        grows over max_size bytes. '''
+
+    def __init__(self, cache_dir, max_size=512*1024*1024) -> None:
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.version = tool_version()
+        try:
+            os.makedirs( cache_dir, exist_ok=True )
+        except OSError as err:
+            print( 'Error creating cache directory:', err )
+            sys.exit(1)
+        self.size = sum( entry.stat().st_size for entry in self.entries() )
+
+    def entries(self) -> list:
+        ''' Return cache entries (os.DirEntry) '''
+        return [ entry for entry in os.scandir( self.cache_dir )
+                 if entry.is_file() and entry.name.endswith( '.pickle' ) ]
+
+    def key(self, data, symbols=None) -> str:
+        ''' Return cache key of input data decompiled with symbols (json data) by this tool version '''
+
+        key = hashlib.sha256( data )
+        key.update( self.version.encode() )
+        key.update( json.dumps( symbols, sort_keys=True ).encode() )
+        return key.hexdigest()
+
+    def path(self, key) -> str:
+        ''' Return cache entry file path '''
+        return os.path.join( self.cache_dir, key + '.pickle' )
+
+    def load(self, key):
+        ''' Return cached value, None if not found '''
+
+        path = self.path( key )
+        try:
+            with open( path, 'rb' ) as f:
+                value = pickle.load( f )
+            os.utime( path )
+        except Exception:
+            # Missing, truncated or unreadable entry
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def load_into(self, decomp):
+        ''' Set decompiled data of decomp (GclDecomp or RadioDecomp) from cache.
+            Return its cache key, and whether it was found. '''
+
+        key = self.key( decomp.gcx, decomp.cache_symbols() )
+        entry = self.load( key )
+        if entry is None:
+            return key, False
+        try:
+            decomp.from_cache( entry )
+        except Exception:
+            # Entry with another layout, decompiled again.
+            decomp.tree_data = []
+            self.hits -= 1
+            self.misses += 1
+            return key, False
+        return key, True
+
+    def decompile(self, decomp, decompile):
+        ''' Load decompiled data of decomp from cache, or call decompile() and store it '''
+
+        key, found = self.load_into( decomp )
+        if not found:
+            decompile()
+            self.store( key, decomp.to_cache() )
+
+    def store(self, key, value):
+        ''' Store value, then remove least recently used entries if needed '''
+
+        try:
+            data = pickle.dumps( value, protocol=pickle.HIGHEST_PROTOCOL )
+        except RecursionError:
+            # Too deep to be pickled, it will be decompiled again next time.
+            return
+        path = self.path( key )
+        if os.path.isfile( path ):
+            self.size -= os.path.getsize( path )
+        with open( path + '.tmp', 'wb' ) as f:
+            f.write( data )
+        os.replace( path + '.tmp', path )
+        self.size += len( data )
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        ''' Remove least recently used entries until cache fits in max_size '''
+
+        entries = sorted( self.entries(), key=lambda entry: entry.stat().st_mtime )
+        self.size = sum( entry.stat().st_size for entry in entries )
+        for entry in entries:
+            if self.size <= self.max_size:
+                break
+            self.size -= entry.stat().st_size
+            os.remove( entry.path )
@@ -138,3 +138,11 @@ class GclCommands(Enum):
     DEMODEBUG = 0xa2bf
     PRINT =     0xb96e
     JIMAKU =    0xec9d # "subtitle"
+
+#-------------------------------------------------------------------------------
+# Opcode to name tables used by the decoders.
+
+RADIO_CODE_NAMES =   { code.value: code.name for code in RadioCode }
+GCL_CODE_NAMES =     { code.value: code.name for code in GclCode }
+GCL_OPERATOR_NAMES = { operator.value: operator.name for operator in GclOperator }
+GCL_COMMAND_NAMES =  { command.value: command.name for command in GclCommands }
@@ -0,0 +1,87 @@
+''' Iterative decoding engine '''
+from types import GeneratorType
+
+class DecodeEngine():
+    ''' Decode nested nodes with an explicit stack of frames instead of recursion.
+
+        A node decoder reads one node and returns it, or returns a generator
+        frame for nodes having children. A frame yields the node decoder to use
+        for each child, receives the decoded child and returns the final node. '''
+
+    def __init__(self, decode_node) -> None:
+
+        self.frames = []
+        self.value = None
+        self.done = False
+        self.max_depth = 0
+        self.push( decode_node() )
+
+    def push(self, value):
+        ''' Push a new frame or keep a finished node as current value '''
+        if type( value ) is GeneratorType:
+            self.frames.append( value )
+            self.value = None
+            self.max_depth = max( self.max_depth, len( self.frames ) )
+        else:
+            self.value = value
+
+    def run(self, max_steps=None) -> bool:
+        ''' Decode until done or until max_steps frames were resumed.
+            Return True when done, run() can be called again to resume. '''
+
+        frames = self.frames
+        value = self.value
+        max_depth = self.max_depth
+        steps = 0
+        while frames:
+            if steps == max_steps:
+                self.value = value
+                self.max_depth = max_depth
+                return False
+            steps += 1
+            try:
+                decode_node = frames[-1].send( value )
+            except StopIteration as stop:
+                frames.pop()
+                value = stop.value
+                continue
+            value = decode_node()
+            if type( value ) is GeneratorType:
+                frames.append( value )
+                value = None
+                if len( frames ) > max_depth:
+                    max_depth = len( frames )
+        self.value = value
+        self.max_depth = max_depth
+        self.done = True
+        return True
+
+def hooked_frame(frame, hooks):
+    ''' Decoding frame calling hooks with the node returned by frame '''
+
+    node = yield from frame
+    node_type, node_value = node.get()
+    for hook in hooks:
+        hook( node_type, node_value )
+    return node
+
+def decode(decode_node):
+    ''' Decode a whole node tree with the iterative engine '''
+
+    engine = DecodeEngine( decode_node )
+    engine.run()
+    return engine.value
+
+def decode_recursive(decode_node):
+    ''' Decode a whole node tree using python recursion (reference implementation) '''
+
+    value = decode_node()
+    if type( value ) is GeneratorType:
+        frame = value
+        value = None
+        try:
+            while True:
+                value = decode_recursive( frame.send( value ) )
+        except StopIteration as stop:
+            value = stop.value
+    return value
@@ -38,6 +38,16 @@ class DemoUnpacker:
         print('Total demo files unpacked:', count)
         return self.demo_files
 
+    def plan(self, sizes) -> list:
+        ''' Return demo files (without data) placed in DEMO.DAT from ( name, size ) list '''
+
+        demo_files = []
+        offset = 0
+        for name, size in sizes:
+            demo_files.append( DatFile( name, offset, None ) )
+            offset += size
+        return demo_files
+
     def pack(self, demo_files):
         ''' Pack demo files into DEMO.DAT buffer '''
 
@@ -0,0 +1,191 @@
+''' Input and output files '''
+import os
+import sys
+import queue
+import threading
+
+def list_files(path, extension) -> list:
+    ''' Return paths of files with extension in directory tree '''
+
+    paths = []
+    for subdir, _dirs, files in os.walk( path ):
+        for file in files:
+            if file.endswith( extension ):
+                paths.append( os.path.join( subdir, file ) )
+    return paths
+
+def read_file(path) -> bytes:
+    ''' Read file data '''
+    try:
+        with open( path, 'rb' ) as f:
+            return f.read()
+    except OSError as err:
+        print( 'Error reading file:', err )
+        sys.exit(1)
+
+class PrefetchReader():
+    ''' Read files in order, the next ones being read ahead on a background thread.
+
+        Iterating yields ( path, data ) while up to depth following files are
+        read. Files are read when iterated if depth is 0. '''
+
+    def __init__(self, paths, depth=4) -> None:
+
+        self.paths = paths
+        self.depth = depth
+
+    def __iter__(self):
+
+        if self.depth <= 0:
+            for path in self.paths:
+                yield path, read_file( path )
+            return
+
+        files = queue.Queue( maxsize=self.depth )
+        stop = threading.Event()
+        def read_ahead():
+            for path in self.paths:
+                if stop.is_set():
+                    return
+                try:
+                    with open( path, 'rb' ) as f:
+                        files.put( ( path, f.read(), None ) )
+                except OSError as err:
+                    files.put( ( path, None, err ) )
+        thread = threading.Thread( target=read_ahead, daemon=True )
+        thread.start()
+
+        try:
+            for _ in self.paths:
+                path, data, err = files.get()
+                if err is not None:
+                    print( 'Error reading file:', err )
+                    sys.exit(1)
+                yield path, data
+        finally:
+            # Unblock the reader thread if iteration stopped early.
+            stop.set()
+            while thread.is_alive():
+                try:
+                    files.get( timeout=0.1 )
+                except queue.Empty:
+                    pass
+
+class OutputWriter():
+    ''' Write output files, leaving files already holding the same data untouched.
+
+        Existing files are compared by size first, then by content. Created
+        directories are remembered so each one is only checked once.
+
+        With writer threads, files are queued and written while the caller
+        goes on. The queue is bounded: write() waits while it is full. '''
+
+    def __init__(self, threads=0, queue_size=64) -> None:
+
+        self.dirs = set()
+        self.written = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.errors = []
+        self.jobs = queue.Queue( maxsize=queue_size )
+        self.threads = []
+        for _ in range( threads ):
+            thread = threading.Thread( target=self.run_jobs, daemon=True )
+            thread.start()
+            self.threads.append( thread )
+
+    def makedirs(self, path):
+        ''' Create directory and its parents if needed '''
+        try:
+            self.create_dirs( path )
+        except OSError as err:
+            print( 'Error creating directory:', err )
+            sys.exit(1)
+
+    def write(self, path, data):
+        ''' Write data (bytes or text) to file if it changed.
+            With writer threads the file is written later (see close()). '''
+
+        if self.threads:
+            self.check_errors()
+            self.jobs.put( ( path, data ) )
+            return
+        try:
+            self.write_file( path, data )
+        except OSError as err:
+            print( 'Error writing file:', err )
+            sys.exit(1)
+
+    def close(self):
+        ''' Wait until queued files are written and stop writer threads '''
+
+        for _ in self.threads:
+            self.jobs.put( None )
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.check_errors()
+
+    def report(self):
+        ''' Print written and skipped files counts '''
+        print( 'Output files: %d written, %d unchanged.' % ( self.written, self.skipped ) )
+
+    #---------------------------------------------------------------------------
+
+    def run_jobs(self):
+        ''' Write queued files (writer thread) '''
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            try:
+                self.write_file( *job )
+            except OSError as err:
+                with self.lock:
+                    self.errors.append( err )
+
+    def check_errors(self):
+        ''' Exit if a writer thread failed '''
+        if self.errors:
+            print( 'Error writing file:', self.errors[0] )
+            sys.exit(1)
+
+    def create_dirs(self, path):
+        ''' Create directory and its parents if not done yet '''
+
+        if path in self.dirs or path == '':
+            return
+        os.makedirs( path, exist_ok=True )
+        self.dirs.add( path )
+
+    def write_file(self, path, data):
+        ''' Write data to file if it changed '''
+
+        if isinstance( data, str ):
+            # Same line endings as files written in text mode
+            if os.linesep != '\n':
+                data = data.replace( '\n', os.linesep )
+            data = data.encode( 'utf-8' )
+
+        if self.is_same( path, data ):
+            with self.lock:
+                self.skipped += 1
+            return
+
+        self.create_dirs( os.path.dirname( path ) )
+        with open( path, 'wb' ) as f:
+            f.write( data )
+        with self.lock:
+            self.written += 1
+
+    def is_same(self, path, data) -> bool:
+        ''' Check if file exists with the same data '''
+
+        try:
+            if os.stat( path ).st_size != len( data ):
+                return False
+            with open( path, 'rb' ) as f:
+                return f.read() == data
+        except OSError:
+            return False
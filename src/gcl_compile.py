@@ -1,24 +1,60 @@
 ''' Compile gcl script to gcx data '''
 import sys
+import json
 
-from gcx import GcxData
+from gcx import GcxData, GclNode, GclLazyBlock, GlyphTable
 from constants import *
 
+# Symbols of the glyph table and game version (see GclComp.symbols)
+GLYPHS_SYMBOL = '#glyphs'
+PC_VERSION_SYMBOL = '#pc'
+
 class GclComp:
     ''' Compile GCL script to GCX data '''
 
     gcx = GcxData()
 
-    def __init__(self, radio=None, is_pc_version=False, vox_files=[], demo_files=[]) -> None:
+    def __init__(self, radio=None, is_pc_version=False, vox_files=[], demo_files=[], glyph_table=None) -> None:
 
         self.gcx = GcxData()
         self.radio = radio
         self.vox_files = vox_files
         self.demo_files = demo_files
+        self.glyph_table = glyph_table or GlyphTable()
         if is_pc_version:
             self.is_pc_version = True
         elif radio is not None:
             self.is_pc_version = radio.is_pc_version
+        # Resolved symbols with their value (see BuildManifest)
+        self.symbols = {}
+        # TABLE symbols ( offset, name ) in gcx data (see GcxObject), and in
+        # the procedure being compiled (None when not recorded).
+        self.relocations = []
+        self.proc_relocations = None
+
+    def resolve_symbol(self, name):
+        ''' Return current value of a symbol used by a compilation, None if not found '''
+
+        if name == GLYPHS_SYMBOL:
+            return self.glyph_table.digest()
+        if name == PC_VERSION_SYMBOL:
+            return self.is_pc_version
+        return self.lookup_table( name )
+
+    def lookup_table(self, name):
+        ''' Return TABLE value of radio dialog, voice or demo file name, None if not found '''
+
+        # Radio dialog file name
+        if name.lower().startswith('rd_'):
+            if name in self.radio.dialog_calls:
+                return int( self.radio.dialog_calls[ name ], 16 )
+        # Voice file name
+        elif name.lower().startswith('vc'):
+            return next((vox_file.block_index for vox_file in self.vox_files if vox_file.name == name), None)
+        # Demo file name
+        elif name.lower().startswith('s'):
+            return next((demo_file.block_index for demo_file in self.demo_files if demo_file.name == name), None)
+        return None
 
     def compile_gcl_file(self, node):
         ''' Compile AST tree to GCX file '''
@@ -27,13 +63,18 @@ class GclComp:
         header = GcxData()
         procedures_data = GcxData()
         fonts_data = GcxData()
+        self.symbols = { PC_VERSION_SYMBOL: self.is_pc_version }
+        relocations = []
 
         for elem in node:
             if 'FONTS' in elem:
+                if any( isinstance( font, int ) for font in elem['FONTS'] ):
+                    self.symbols[GLYPHS_SYMBOL] = self.glyph_table.digest()
                 for font in elem['FONTS']:
-                    fonts_data.push_hex_string( font )
+                    fonts_data.push_hex_string( self.glyph_table.resolve( font ) )
                 continue
             proc_id = elem[ 'PROC_ID' ]
+            self.proc_relocations = []
             proc_data = self.compile_gcl( elem[ 'PROC_DATA' ] )
             if proc_id == 0:
                 data.push_short( proc_id )
@@ -43,10 +84,13 @@ class GclComp:
                 header.push_short( proc_id )
                 header.push_short( len( procedures_data ) )
 
+            relocations.extend( ( len( procedures_data ) + offset, name ) for offset, name in self.proc_relocations )
             procedures_data.extend( proc_data )
+        self.proc_relocations = None
 
         data.extend( header )
         data.push_int( 0 )
+        self.relocations = [ ( len( data ) + offset, name ) for offset, name in relocations ]
         data.extend( procedures_data )
         data.push_int( len( fonts_data ) )
         data.extend( fonts_data )
@@ -58,200 +102,262 @@ class GclComp:
         self.gcx = data
         return data
 
-    def compile_gcl(self, node):
-        ''' Compile GCL AST to GCX data '''
-
-        data = GcxData()
-
-        if isinstance( node, list ):
-            for child in node:
-                data.extend( self.compile_gcl( child ) )
-            return data
-
-        gcl_code, value = node.get()
-
-        match gcl_code:
-
-            case GclCode.WORD.name:
-
-                data.push_short( value )
-
-            case GclCode.BYTE.name:
-
-                data.push_byte( value )
-
-            case GclCode.CHAR.name:
-
-                data.push_byte( ord( value ) )
-
-            case GclCode.FLAG.name:
-
-                data.push_byte( value )
-
-            case GclCode.STR_ID.name:
-
-                data.push_short( value )
-
-            case GclCode.STR.name:
-
-                string = self.gcx.encode_string( value )
-                data.push_byte( len( string ) )
-                data.extend( string )
-
-            case GclCode.PROC.name:
-
-                data.push_short( value )
-
-            case GclCode.SD_CODE.name:
-
-                data.push_int( value )
-
-            case GclCode.TABLE.name:
-
-                if isinstance( value, str ):
-                    # Resolve radio dialog file name.
-                    if value.lower().startswith('rd_'):
-                        if not value in self.radio.dialog_calls:
-                            print('Error: could not resolve radio code', hex(value))
-                            sys.exit(1)
-                        value = int( self.radio.dialog_calls[ value ], 16 )
-                    # Resolve voice file name
-                    elif value.lower().startswith('vc'):
-                        value = next((vox_file.block_index for vox_file in self.vox_files if vox_file.name == value), '')
-                        if value == '':
-                            print('Error: could not resolve voice code')
-                            sys.exit(1)
-                    # Resolve demo file name
-                    elif value.lower().startswith('s'):
-                        value = next((demo_file.block_index for demo_file in self.demo_files if demo_file.name == value), '')
-                        if value == '':
-                            print('Error: could not resolve demo code')
-                            sys.exit(1)
-                    else:
-                        print('unexpected table value', hex(value))
-                        sys.exit(1)
-
-                data.push_int( value )
-
-            case GclCode.VAR.name:
-
-                var_type, var_value = value.get()
-                data.push_byte( GclCode.VAR.value + GclCode[var_type].value )
-                data.push_hex_string( var_value )
-                return data
-
-            case GclCode.ARG.name:
-
-                data.push_byte( value )
-
-            case GclCode.EXPR.name:
-
-                expression = GcxData()
-                for operator in value:
-                    operation = self.compile_gcl( operator )
-                    expression.extend( operation )
-                expression.push_byte( GclCode.OP.value )
-                expression.push_byte( 0 )
-
-                data.push_byte( len( expression ) + 1 )
-                data.extend( expression )
-
-            case GclCode.OP.name:
-
-                operator, operands = value.get()
-                data.extend( self.compile_gcl( operands[0] ) )
-                data.extend( self.compile_gcl( operands[1] ) )
-                data.push_byte( GclCode.OP.value )
-                data.push_byte( GclOperator[ operator ].value )
-                return data
-
-            case GclCode.SCRIPT.name:
-
-                script = self.compile_gcl( value )
-                script.push_byte( 0 )
-
-                data.push_short( len( script ) + 2 )
-                data.extend( script )
-
-                if 'NO_BRACES' in node:
-                    data = data[:-1]
-
-            case GclCode.OPTION.name:
+    def compile_gcl(self, node, data=None):
+        ''' Compile GCL AST to GCX data.
+
+            The tree is walked with an explicit stack and every node is written
+            directly into the output buffer. Block sizes are reserved when a
+            block starts and filled in by its end marker, once its children are
+            written. Stack items are nodes, lists of nodes or markers
+            (action, arg, extra) calling action(data, stack, arg, extra). '''
+
+        if data is None:
+            data = GcxData()
+
+        stack = [ node ]
+        while stack:
+            item = stack.pop()
+            if type( item ) is tuple:
+                action, arg, extra = item
+                action( self, data, stack, arg, extra )
+            elif isinstance( item, list ) or isinstance( item, GclLazyBlock ):
+                stack.extend( reversed( item ) )
+            else:
+                gcl_code, value = item.get()
+                encoder = self.encoders.get( gcl_code )
+                if encoder is None:
+                    print('Unexpected code %s while compiling..' % gcl_code)
+                    sys.exit(1)
+                encoder( self, data, stack, item, value )
 
-                option_letter, option_values = value.get()
-                option_values = self.compile_gcl( option_values )
+        return data
 
-                data.push_byte( ord( option_letter ) )
-                if 'NULL_SIZE' in value:
-                    data.push_byte( 0 )
+    #---------------------------------------------------------------------------
+    # Leaf encoders
+
+    def encode_byte(self, data, stack, node, value):
+        ''' Encode BYTE, FLAG and ARG nodes '''
+        data.push_byte( GclCode[ node.get()[0] ].value )
+        data.push_byte( value )
+
+    def encode_word(self, data, stack, node, value):
+        ''' Encode WORD, STR_ID and PROC nodes '''
+        data.push_byte( GclCode[ node.get()[0] ].value )
+        data.push_short( value )
+
+    def encode_char(self, data, stack, node, value):
+        ''' Encode CHAR node '''
+        data.push_byte( GclCode.CHAR.value )
+        data.push_byte( ord( value ) )
+
+    def encode_str(self, data, stack, node, value):
+        ''' Encode STR node '''
+        string = self.gcx.encode_string( value )
+        data.push_byte( GclCode.STR.value )
+        data.push_byte( len( string ) )
+        data.extend( string )
+
+    def encode_sd_code(self, data, stack, node, value):
+        ''' Encode SD_CODE node '''
+        data.push_byte( GclCode.SD_CODE.value )
+        data.push_int( value )
+
+    def encode_table(self, data, stack, node, value):
+        ''' Encode TABLE node '''
+
+        if isinstance( value, str ):
+            name = value
+            value = self.lookup_table( name )
+            if value is None:
+                if name.lower().startswith('rd_'):
+                    print('Error: could not resolve radio code', name)
+                elif name.lower().startswith('vc'):
+                    print('Error: could not resolve voice code')
+                elif name.lower().startswith('s'):
+                    print('Error: could not resolve demo code')
                 else:
-                    data.push_byte( len( option_values ) + 1 )
-                data.extend( option_values )
-
-            case GclCode.CMD.name:
-
-                cmd_name, cmd_args = value.get()
-                cmd_code = GclCommands[ cmd_name ].value
-
-                command = GcxData()
-                command.push_short( cmd_code )
-
-                command_args = GcxData()
-                for arg in cmd_args:
-                    arg_type, arg_value = arg.get()
-                    if arg_type == GclCode.OPTION.name:
-                        break
-                    argument = self.compile_gcl( arg )
-                    command_args.extend( argument )
-
-                args_size = len( command_args ) + 1
-
-                # Patch 'if' size
-                if cmd_name == GclCommands.IF.name and len( cmd_args ) == 2:
-                    args_size += 1
-
-                command_options = GcxData()
-                for i, arg in enumerate( cmd_args ):
-                    arg_type, arg_value = arg.get()
-                    if arg_type != GclCode.OPTION.name:
-                        continue
-                    option = self.compile_gcl( arg )
-
-                    # Patch 'elseif' and 'else' sizes
-                    if cmd_name == GclCommands.IF.name:
-                        opt_letter, opt_value = arg_value.get()
-                        if opt_letter == 'i' and len(opt_value) == 2 and i == len(cmd_args) - 1:
-                            option[2] += 1
-                        elif opt_letter == 'e' and len(opt_value) == 1 and i == len(cmd_args) - 1:
-                            option[2] += 1
-
-                    command_options.extend( option )
-
-                command.push_byte( args_size )
-                command.extend( command_args )
-
-                command.extend( command_options )
-                command.push_byte( 0 )
-
-                data.push_short( len( command ) + 2 )
-                data.extend( command )
-
-            case GclCode.CALL.name:
-
-                procedure_id, procedure_args = value.get()
-
-                call = GcxData()
-                call.push_short( int( procedure_id ) )
-                for arg in procedure_args:
-                    call.extend( self.compile_gcl( arg ) )
-                call.push_byte( 0 )
-
-                data.push_byte( len( call ) + 1 )
-                data.extend( call )
-
-            case _:
-                print('Unexpected code %s while compiling..' % gcl_code)
+                    print('unexpected table value', name)
                 sys.exit(1)
+            self.symbols[name] = value
+            if self.proc_relocations is not None:
+                self.proc_relocations.append( ( len( data ) + 1, name ) )
+
+        data.push_byte( GclCode.TABLE.value )
+        data.push_int( value )
+
+    def encode_var(self, data, stack, node, value):
+        ''' Encode VAR node (the variable type is part of the code) '''
+        var_type, var_value = value.get()
+        data.push_byte( GclCode.VAR.value + GclCode[var_type].value )
+        data.push_hex_string( var_value )
+
+    #---------------------------------------------------------------------------
+    # Block encoders, children are pushed after the block end marker
+
+    def encode_expr(self, data, stack, node, value):
+        ''' Encode EXPR block '''
+        data.push_byte( GclCode.EXPR.value )
+        stack.append( ( GclComp.end_expr, len( data ), None ) )
+        data.push_byte( 0 )
+        stack.extend( reversed( value ) )
+
+    def encode_op(self, data, stack, node, value):
+        ''' Encode OP node (operands first, no code byte) '''
+        operator, operands = value.get()
+        stack.append( ( GclComp.end_op, GclOperator[ operator ].value, None ) )
+        stack.append( operands[1] )
+        stack.append( operands[0] )
+
+    def encode_script(self, data, stack, node, value):
+        ''' Encode SCRIPT block '''
+        data.push_byte( GclCode.SCRIPT.value )
+        stack.append( ( GclComp.end_script, len( data ), 'NO_BRACES' in node ) )
+        data.push_short( 0 )
+        stack.append( value )
+
+    def encode_option(self, data, stack, node, value, patch=0):
+        ''' Encode OPTION block '''
+        option_letter, option_values = value.get()
+        data.push_byte( GclCode.OPTION.value )
+        data.push_byte( ord( option_letter ) )
+        end_option = GclComp.end_null_option if 'NULL_SIZE' in value else GclComp.end_option
+        stack.append( ( end_option, len( data ), patch ) )
+        data.push_byte( 0 )
+        stack.append( option_values )
+
+    def encode_patched_option(self, data, stack, node, value):
+        ''' Encode last 'elseif' or 'else' OPTION block of an 'if' command '''
+        self.encode_option( data, stack, node, value, patch=1 )
+
+    def encode_cmd(self, data, stack, node, value):
+        ''' Encode CMD block '''
+
+        cmd_name, cmd_args = value.get()
+
+        data.push_byte( GclCode.CMD.value )
+        stack.append( ( GclComp.end_cmd, len( data ), None ) )
+        data.push_short( 0 )
+        data.push_short( GclCommands[ cmd_name ].value )
+
+        options = []
+        for i, arg in enumerate( cmd_args ):
+            arg_type, arg_value = arg.get()
+            if arg_type != GclCode.OPTION.name:
+                continue
 
-        data.insert( 0, GclCode[ gcl_code ].value )
-        return data
+            # Patch 'elseif' and 'else' sizes
+            encoder = GclComp.encode_option
+            if cmd_name == GclCommands.IF.name and i == len(cmd_args) - 1:
+                opt_letter, opt_value = arg_value.get()
+                if opt_letter == 'i' and len(opt_value) == 2:
+                    encoder = GclComp.encode_patched_option
+                elif opt_letter == 'e' and len(opt_value) == 1:
+                    encoder = GclComp.encode_patched_option
+            options.append( ( encoder, arg, arg_value ) )
+        stack.extend( reversed( options ) )
+
+        args = []
+        for arg in cmd_args:
+            arg_type, arg_value = arg.get()
+            if arg_type == GclCode.OPTION.name:
+                break
+            args.append( arg )
+
+        # Patch 'if' size
+        args_patch = 0
+        if cmd_name == GclCommands.IF.name and len( cmd_args ) == 2:
+            args_patch = 1
+
+        stack.append( ( GclComp.end_args, len( data ), args_patch ) )
+        data.push_byte( 0 )
+        stack.extend( reversed( args ) )
+
+    def encode_call(self, data, stack, node, value):
+        ''' Encode CALL block '''
+        procedure_id, procedure_args = value.get()
+        data.push_byte( GclCode.CALL.value )
+        stack.append( ( GclComp.end_call, len( data ), None ) )
+        data.push_byte( 0 )
+        data.push_short( int( procedure_id ) )
+        stack.extend( reversed( procedure_args ) )
+
+    #---------------------------------------------------------------------------
+    # Block end markers, called once the block children are written
+
+    def end_expr(self, data, stack, size_offset, extra):
+        ''' Terminate EXPR block and write its size '''
+        data.push_byte( GclCode.OP.value )
+        data.push_byte( 0 )
+        data.write_byte( size_offset, len( data ) - size_offset )
+
+    def end_op(self, data, stack, operator, extra):
+        ''' Write OP operator once its operands are written '''
+        data.push_byte( GclCode.OP.value )
+        data.push_byte( operator )
+
+    def end_script(self, data, stack, size_offset, no_braces):
+        ''' Terminate SCRIPT block and write its size '''
+        data.push_byte( 0 )
+        data.write_short( size_offset, len( data ) - size_offset )
+        # Size still counts the missing terminator
+        if no_braces:
+            data.pop()
+
+    def end_option(self, data, stack, size_offset, patch):
+        ''' Write OPTION size '''
+        data.write_byte( size_offset, len( data ) - size_offset )
+        data[size_offset] += patch
+
+    def end_null_option(self, data, stack, size_offset, patch):
+        ''' Write OPTION null size '''
+        data[size_offset] += patch
+
+    def end_args(self, data, stack, size_offset, patch):
+        ''' Write CMD arguments size '''
+        data.write_byte( size_offset, len( data ) - size_offset + patch )
+
+    def end_cmd(self, data, stack, size_offset, extra):
+        ''' Terminate CMD block and write its size '''
+        data.push_byte( 0 )
+        data.write_short( size_offset, len( data ) - size_offset )
+
+    def end_call(self, data, stack, size_offset, extra):
+        ''' Terminate CALL block and write its size '''
+        data.push_byte( 0 )
+        data.write_byte( size_offset, len( data ) - size_offset )
+
+    # Encoders write the node code and data, block encoders also push their
+    # end marker and children on the compiling stack.
+    encoders = {}
+
+GclComp.encoders.update({
+    GclCode.WORD.name:    GclComp.encode_word,
+    GclCode.BYTE.name:    GclComp.encode_byte,
+    GclCode.CHAR.name:    GclComp.encode_char,
+    GclCode.FLAG.name:    GclComp.encode_byte,
+    GclCode.STR_ID.name:  GclComp.encode_word,
+    GclCode.STR.name:     GclComp.encode_str,
+    GclCode.PROC.name:    GclComp.encode_word,
+    GclCode.SD_CODE.name: GclComp.encode_sd_code,
+    GclCode.TABLE.name:   GclComp.encode_table,
+    GclCode.VAR.name:     GclComp.encode_var,
+    GclCode.ARG.name:     GclComp.encode_byte,
+    GclCode.EXPR.name:    GclComp.encode_expr,
+    GclCode.OP.name:      GclComp.encode_op,
+    GclCode.SCRIPT.name:  GclComp.encode_script,
+    GclCode.OPTION.name:  GclComp.encode_option,
+    GclCode.CMD.name:     GclComp.encode_cmd,
+    GclCode.CALL.name:    GclComp.encode_call,
+})
+
+def compile_gcl_source(source, link_map, glyph_table):
+    ''' Compile gcl json source with symbols of a LinkMap (worker process).
+        Return ( gcx, symbols, relocations ). '''
+
+    node = json.loads( source.decode( 'utf-8' ), object_hook=GclNode )
+    if isinstance( node, dict ):
+        node = GclNode( node )
+    gcl = GclComp( radio=link_map, vox_files=link_map.vox_files, demo_files=link_map.demo_files,
+                   glyph_table=glyph_table )
+    gcl.compile_gcl_file( node )
+    return gcl.gcx, gcl.symbols, gcl.relocations
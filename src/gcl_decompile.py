@@ -1,11 +1,31 @@
 ''' Decompile gcx file to gcl code '''
 import sys
 import json
-import textwrap
+from types import GeneratorType
 
-from gcx import GclNode, GcxData
+from gcx import GclNode, GcxData, GclLazyBlock, GlyphTable, json_default
+from decode_engine import decode, hooked_frame
+from script_writer import ScriptWriter
 from constants import *
 
+# Opcodes and names compared in the decoding loop.
+NULL_CODE =     GclCode.GCL_NULL.value
+VAR_CODE =      GclCode.VAR.value
+OPTION_CODE =   GclCode.OPTION.value
+ARG_CODE =      GclCode.ARG.value
+VAR_NAME =      GclCode.VAR.name
+EXPR_NAME =     GclCode.EXPR.name
+OP_NAME =       GclCode.OP.name
+SCRIPT_NAME =   GclCode.SCRIPT.name
+OPTION_NAME =   GclCode.OPTION.name
+CMD_NAME =      GclCode.CMD.name
+CALL_NAME =     GclCode.CALL.name
+OP_NULL_NAME =  GclOperator.OP_NULL.name
+IF_COMMAND =    GclCommands.IF.value
+RADIO_COMMAND = GclCommands.RADIO.value
+SOUND_COMMAND = GclCommands.SOUND.value
+DEMO_COMMAND =  GclCommands.DEMO.value
+
 class GclDecomp:
     ''' Decompile gcx file to gcl code '''
 
@@ -13,7 +33,7 @@ class GclDecomp:
     procedures = []
     commands_stack = []
 
-    def __init__(self, gcx: GcxData, radio=None, vox_files=[], demo_files=[]) -> None:
+    def __init__(self, gcx: GcxData, radio=None, vox_files=[], demo_files=[], lazy=False, glyph_table=None) -> None:
 
         self.gcx = gcx
         self.procedures = []
@@ -22,29 +42,94 @@ class GclDecomp:
         self.radio = radio
         self.vox_files = vox_files
         self.demo_files = demo_files
+        # Nested scripts are kept undecoded until first access.
+        self.lazy = lazy
+        # Fonts are stored as glyph ids when a shared glyph table is used.
+        self.glyph_table = glyph_table
+        # Decoding hooks by opcode, and highest argument index by procedure id.
+        self.hooks = {}
+        self.proc_args = {}
+        self.max_arg_index = 0
+        self.add_hook( ARG_CODE, self.check_arg )
+
+    def add_hook(self, gcl_code, hook):
+        ''' Call hook( node_type, node_value ) for every node of gcl_code when decoded '''
+        self.hooks.setdefault( gcl_code, [] ).append( hook )
+
+    def check_arg(self, node_type, node_value):
+        ''' Keep highest argument index of current procedure (decoding hook) '''
+        if node_value > self.max_arg_index:
+            self.max_arg_index = node_value
 
     def to_json(self, indent=None) -> str:
         ''' Return decompiled data in json format '''
 
-        return json.dumps( self.tree_data, indent=indent )
+        return json.dumps( self.tree_data, indent=indent, default=json_default )
 
     def to_gcl_script(self) -> str:
         ''' Return decompiled data in gcl script format '''
 
-        gcl = ''
+        writer = ScriptWriter()
         for elem in self.tree_data:
-            gcl += self.decomp_script( elem )
-        return gcl
+            self.write_script( elem, writer )
+        return writer.getvalue()
+
+    def export_script(self, path='out.gcl'):
+        ''' Export AST data to gcl script file '''
+        with open( path, 'w', encoding='utf-8' ) as f:
+            writer = ScriptWriter( f )
+            for elem in self.tree_data:
+                self.write_script( elem, writer )
+            writer.close()
 
     def export_json(self, path='out.json', indent=None):
         ''' Export AST data to json file '''
         with open( path, 'w', encoding='utf-8' ) as f:
-            f.write( json.dumps( self.tree_data, indent=indent ) )
+            f.write( json.dumps( self.tree_data, indent=indent, default=json_default ) )
+
+    def cache_symbols(self) -> dict:
+        ''' Return data used to decompile gcx data besides itself (see DecompCache) '''
+        return {
+            'radio': sorted( self.radio.dialog_names.items() ) if self.radio is not None else None,
+            'vox':   [ [ vox_file.name, vox_file.offset ] for vox_file in self.vox_files ],
+            'demo':  [ [ demo_file.name, demo_file.offset ] for demo_file in self.demo_files ],
+        }
+
+    def to_cache(self) -> dict:
+        ''' Return decompiled data for DecompCache, font glyphs as hex strings '''
+
+        glyph_table = self.glyph_table or GlyphTable()
+        tree_data = []
+        for elem in self.tree_data:
+            if 'FONTS' in elem:
+                elem = { 'FONTS': [ glyph_table.resolve( font ) for font in elem['FONTS'] ] }
+            tree_data.append( elem )
+        return {
+            'tree_data': tree_data,
+            'proc_args': self.proc_args,
+        }
+
+    def from_cache(self, entry):
+        ''' Set decompiled data from DecompCache entry '''
+
+        self.tree_data = entry['tree_data']
+        self.proc_args = entry['proc_args']
+        for elem in self.tree_data:
+            if 'FONTS' in elem and self.glyph_table is not None:
+                elem['FONTS'] = self.glyph_table.intern_all( elem['FONTS'] )
 
     def decompile_gcx_file(self):
         ''' Decompile GCX file to AST data '''
+
+        for elem in self.iter_procedures():
+            self.tree_data.append( elem )
+
+    def read_procedures(self):
+        ''' Read procedures header '''
         # Read procedures id's (that was hashed using GV_StrCode())
         #   and their relative offsets.
+        self.gcx.offset = 0
+        self.procedures = []
         while True:
             proc_id = self.gcx.read_short()
             proc_offset = self.gcx.read_short()
@@ -57,16 +142,26 @@ class GclDecomp:
         # Move main procedure at the end.
         self.procedures = self.procedures[1:] + self.procedures[:1]
         header_size = self.gcx.offset
-        # Read procedures data.
         for proc in self.procedures:
             if proc['id'] == 0:
-                self.gcx.offset = proc['offset'] + 8
+                proc['data_offset'] = proc['offset'] + 8
             else:
-                self.gcx.offset = proc['offset'] + header_size
-            self.tree_data.append({
+                proc['data_offset'] = proc['offset'] + header_size
+        return self.procedures
+
+    def iter_procedures(self):
+        ''' Decompile procedures one at a time, followed by fonts '''
+
+        # Read procedures data.
+        for proc in self.read_procedures():
+            self.gcx.offset = proc['data_offset']
+            self.max_arg_index = 0
+            proc_data = self.decompile_gcx()
+            self.proc_args[proc['id']] = self.max_arg_index
+            yield {
                 'PROC_ID':   proc['id'],
-                'PROC_DATA': self.decompile_gcx()
-            })
+                'PROC_DATA': proc_data
+            }
         # Read fonts images data.
         fonts_size = self.gcx.read_int() - 2
         fonts_end = self.gcx.offset + fonts_size
@@ -75,270 +170,314 @@ class GclDecomp:
             font = self.gcx.read_hex_string( 36 )
             fonts.append( font )
         if len( fonts ) > 0:
-            self.tree_data.append({
+            if self.glyph_table is not None:
+                fonts = self.glyph_table.intern_all( fonts )
+            yield {
                 'FONTS': fonts,
-            })
+            }
 
     def current_command(self):
         ''' Get the current command during decompilation '''
 
         return self.commands_stack[-1:][0]
 
+    def decompile_script(self, end_offset):
+        ''' Decompile script commands until end offset (decoding frame) '''
+
+        value = []
+        while self.gcx.offset < end_offset:
+            command_or_call = yield self.decode_node
+            if not command_or_call:
+                break
+            value.append( command_or_call )
+        return value
+
+    def decompile_block(self, offset, end_offset, commands_stack) -> list:
+        ''' Decompile a script block left undecoded by lazy mode '''
+
+        saved_offset = self.gcx.offset
+        saved_stack = self.commands_stack
+        self.gcx.offset = offset
+        self.commands_stack = commands_stack.copy()
+        value = decode( lambda: self.decompile_script( end_offset ) )
+        self.gcx.offset = saved_offset
+        self.commands_stack = saved_stack
+        return value
+
     def decompile_gcx(self):
         ''' Build json tree from gcx data '''
 
+        return decode( self.decode_node )
+
+    def decode_node(self):
+        ''' Read one node, return it or the frame decoding its children '''
+
         gcl_code = self.gcx.read_byte()
 
-        if gcl_code & 0xF0 == GclCode.VAR.value:
-
-            variable = ''
-            for _ in range(3):
-                variable += '%02X' % self.gcx.read_byte()
+        if gcl_code & 0xF0 == VAR_CODE:
+
+            offset = self.gcx.offset
+            self.gcx.offset += 3
+            variable = self.gcx[offset:offset+3].hex().upper()
+            return GclNode({ VAR_NAME: GclNode({ GCL_CODE_NAMES[ gcl_code & 0xF ]: variable }) })
+
+        if gcl_code == NULL_CODE:
+            return None
+
+        decoder = self.decoders.get( gcl_code )
+        if decoder is None:
+            print(f'Error: unexpected default case (GclCode: {gcl_code}, offset: {self.gcx.offset})')
+            sys.exit(1)
+
+        value = decoder( self )
+        hooks = self.hooks.get( gcl_code )
+        if type( value ) is GeneratorType:
+            if hooks:
+                return hooked_frame( value, hooks )
+            return value
+        if hooks:
+            for hook in hooks:
+                hook( GCL_CODE_NAMES[ gcl_code ], value )
+        return GclNode({ GCL_CODE_NAMES[ gcl_code ]: value })
+
+    def decode_word(self):
+        ''' Decode WORD value '''
+        return self.gcx.read_short()
+
+    def decode_byte(self):
+        ''' Decode BYTE value '''
+        return self.gcx.read_byte()
+
+    def decode_char(self):
+        ''' Decode CHAR value '''
+        return chr( self.gcx.read_byte() )
+
+    def decode_flag(self):
+        ''' Decode FLAG value '''
+        return self.gcx.read_byte() == 1
+
+    def decode_str(self):
+        ''' Decode STR value '''
+        size = self.gcx.read_byte()
+        return self.gcx.read_string( length=size )
+
+    def decode_sd_code(self):
+        ''' Decode SD_CODE value '''
+        return self.gcx.read_int()
+
+    def decode_table(self):
+        ''' Decode TABLE value and resolve file names from it '''
+
+        value = self.gcx.read_int()
+        command = self.current_command()
+        # Resolve radio dialog file name from offset.
+        if command == RADIO_COMMAND and self.radio is not None:
+            dialog_index = ( value & 0xffff ) * 0x800
+            value = self.radio.dialog_names.get( dialog_index, value )
+        # Resolve vox file name.
+        elif command == SOUND_COMMAND and len( self.vox_files ) > 0:
+            voice_name = next((vox_file.name for vox_file in self.vox_files if vox_file.block_index == value), '')
+            if voice_name == '':
+                print('Error: could not resolve voice code', hex(value))
+                sys.exit(1)
+            value = voice_name
+        # Resolve demo file name.
+        elif command == DEMO_COMMAND and len( self.demo_files ) > 0 and value != 0xffffffff:
+            demo_name = next((demo_file.name for demo_file in self.demo_files if demo_file.block_index == value), '')
+            if demo_name == '':
+                print('Error: could not resolve demo code', hex(value))
+                sys.exit(1)
+            value = demo_name
+        return value
+
+    def decode_expr(self):
+        ''' Decode EXPR operands and fold operators (decoding frame) '''
+
+        size = self.gcx.read_byte() - 1
+        end_offset = self.gcx.offset + size
+
+        operands = []
+        while self.gcx.offset < end_offset:
+            op = yield self.decode_node
+            op_type, op_value = op.get()
+            # Operator
+            if op_type == OP_NAME:
+                if op_value == OP_NULL_NAME:
+                    break
+                operation = GclNode({
+                    op_type: GclNode({
+                        op_value: operands[-2:]
+                    })
+                })
+                del operands[-2:]
+                operands.append( operation )
+            # Operand
+            else:
+                operands.append( op )
+
+        return GclNode({ EXPR_NAME: operands })
+
+    def decode_op(self):
+        ''' Decode OP operator '''
+        return GCL_OPERATOR_NAMES[ self.gcx.read_byte() ]
+
+    def decode_script(self):
+        ''' Decode SCRIPT block (decoding frame) '''
+
+        size = self.gcx.read_short() - 2
+        end_offset = self.gcx.offset + size
+
+        # Only nested scripts ending with their null byte can be skipped.
+        if self.lazy and len( self.commands_stack ) > 0 \
+                     and self.gcx.read_byte( end_offset - 1 ) == 0:
+            value = GclLazyBlock( self, self.gcx.offset, end_offset, self.commands_stack.copy() )
+            self.gcx.offset = end_offset
+            return GclNode({ SCRIPT_NAME: value })
+
+        value = yield from self.decompile_script( end_offset )
+        return GclNode({ SCRIPT_NAME: value })
+
+    def decode_option(self):
+        ''' Decode OPTION block (decoding frame) '''
+
+        option_letter = chr( self.gcx.read_byte() )
+        size = self.gcx.read_byte() - 1
+
+        data = []
+        # Sadly we can't rely on size here so we have to check end byte...
+        while True:
+            code = self.gcx.read_byte( self.gcx.offset )
+            if not code or code == OPTION_CODE:
+                break
+
+            option_offset = self.gcx.offset
+            val = yield self.decode_node
+            if not val:
+                break
+
+            # Checks if no braces "{}" were used in "elseif" or "else" declaration (my theory)
+            #   because it alters the size and we need this info for recompiling matching gcx..
+            opt_type, _ = val.get()
+            if self.current_command() == IF_COMMAND and opt_type == SCRIPT_NAME:
+                script_size = self.gcx.read_short( option_offset + 1 )
+                if script_size + 2 - size == 1:
+                    val['NO_BRACES'] = True
 
-            value = GclNode({ GclCode( gcl_code & 0xF ).name: variable })
-            gcl_code = GclCode.VAR.value
+            data.append( val )
 
-        else:
-            match gcl_code:
-
-                case GclCode.GCL_NULL.value:
-                    return None
-
-                case GclCode.WORD.value:
-                    value = self.gcx.read_short()
+        value = GclNode({ option_letter: data })
 
-                case GclCode.BYTE.value:
-                    value = self.gcx.read_byte()
+        # If data with null size, we need to save the info for the compiler as well..
+        if size == -1 and len(data) > 0:
+            value['NULL_SIZE'] = True
+        return GclNode({ OPTION_NAME: value })
 
-                case GclCode.CHAR.value:
-                    value = chr( self.gcx.read_byte() )
-
-                case GclCode.FLAG.value:
-                    value = self.gcx.read_byte() == 1
-
-                case GclCode.STR_ID.value:
-                    value = self.gcx.read_short()
-
-                case GclCode.STR.value:
-
-                    size = self.gcx.read_byte()
-                    value = self.gcx.read_string( length=size )
-
-                case GclCode.PROC.value:
-                    value = self.gcx.read_short()
-
-                case GclCode.SD_CODE.value:
-                    value = self.gcx.read_int()
-
-                case GclCode.TABLE.value:
-
-                    value = self.gcx.read_int()
-                    command = self.current_command()
-                    # Resolve radio dialog file name from offset.
-                    if command == GclCommands.RADIO.value and self.radio is not None:
-                        dialog_index = ( value & 0xffff ) * 0x800
-                        for dialog in self.radio.tree_data:
-                            if dialog['DIALOG']['OFFSET'] == dialog_index:
-                                value = dialog['DIALOG']['NAME']
-                                break
-                    # Resolve vox file name.
-                    elif command == GclCommands.SOUND.value and len( self.vox_files ) > 0:
-                        voice_name = next((vox_file.name for vox_file in self.vox_files if vox_file.block_index == value), '')
-                        if voice_name == '':
-                            print('Error: could not resolve voice code', hex(value))
-                            sys.exit(1)
-                        value = voice_name
-                    # Resolve demo file name.
-                    elif command == GclCommands.DEMO.value and len( self.demo_files ) > 0 and value != 0xffffffff:
-                        demo_name = next((demo_file.name for demo_file in self.demo_files if demo_file.block_index == value), '')
-                        if demo_name == '':
-                            print('Error: could not resolve demo code', hex(value))
-                            sys.exit(1)
-                        value = demo_name
-
-                case GclCode.ARG.value:
-
-                    # Procedure argument index (on the stack)
-                    value = self.gcx.read_byte()
-
-                case GclCode.EXPR.value:
-
-                    size = self.gcx.read_byte() - 1
-                    end_offset = self.gcx.offset + size
-
-                    operands = []
-                    while self.gcx.offset < end_offset:
-                        op = self.decompile_gcx()
-                        op_type, op_value = op.get()
-                        # Operator
-                        if op_type == GclCode.OP.name:
-                            if op_value == GclOperator.OP_NULL.name:
-                                break
-                            operation = GclNode({
-                                op_type: GclNode({
-                                    op_value: operands[-2:]
-                                })
-                            })
-                            del operands[-2:]
-                            operands.append( operation )
-                        # Operand
-                        else:
-                            operands.append( op )
-
-                    value = operands
-
-                case GclCode.OP.value:
-
-                    operator = self.gcx.read_byte()
-                    value = GclOperator( operator ).name
-
-                case GclCode.SCRIPT.value:
-
-                    size = self.gcx.read_short() - 2
-                    end_offset = self.gcx.offset + size
-
-                    value = []
-                    while self.gcx.offset < end_offset:
-                        command_or_call = self.decompile_gcx()
-                        if not command_or_call:
-                            break
-                        value.append( command_or_call )
-
-                case GclCode.OPTION.value:
-
-                    option_letter = chr( self.gcx.read_byte() )
-                    size = self.gcx.read_byte() - 1
-                    end_offset = self.gcx.offset + size
-
-                    data = []
-                    # Sadly we can't rely on size here so we have to check end byte...
-                    while True:
-                        code = self.gcx.read_byte( self.gcx.offset )
-                        if not code or code == GclCode.OPTION.value:
-                            break
-
-                        option_offset = self.gcx.offset
-                        val = self.decompile_gcx()
-                        if not val:
-                            break
-
-                        # Checks if no braces "{}" were used in "elseif" or "else" declaration (my theory)
-                        #   because it alters the size and we need this info for recompiling matching gcx..
-                        opt_type, _ = val.get()
-                        if self.current_command() == GclCommands.IF.value and opt_type == GclCode.SCRIPT.name:
-                            script_size = self.gcx.read_short( option_offset + 1 )
-                            if script_size + 2 - size == 1:
-                                val['NO_BRACES'] = True
-
-                        data.append( val )
-
-                    value = GclNode({ option_letter: data })
-
-                    # If data with null size, we need to save the info for the compiler as well..
-                    if size == -1 and len(data) > 0:
-                        value['NULL_SIZE'] = True
-
-                case GclCode.CMD.value:
-
-                    size = self.gcx.read_short() - 2
-                    end_offset = self.gcx.offset + size
-
-                    command_id = self.gcx.read_short()
-                    self.commands_stack.append( command_id )
-
-                    args_size = self.gcx.read_byte() - 1
-                    args_end = self.gcx.offset + args_size
-                    args = []
-                    while True:
-                        code = self.gcx.read_byte( self.gcx.offset )
-                        if not code:
-                            break
-                        arg = self.decompile_gcx()
-                        if not arg:
-                            break
-                        args.append( arg )
+    def decode_cmd(self):
+        ''' Decode CMD block (decoding frame) '''
 
-                    # Checks if no braces "{}" were used in "if" declaration
-                    if command_id == GclCommands.IF.value and args_end - self.gcx.offset == 0:
-                        args[1]['NO_BRACES'] = True
-
-                    options = []
-                    while self.gcx.offset < end_offset:
-                        option = self.decompile_gcx()
-                        if not option:
-                            break
-                        options.append( option )
-
-                    value = GclNode({ GclCommands( command_id ).name: args + options })
-
-                    self.commands_stack.pop()
+        size = self.gcx.read_short() - 2
+        end_offset = self.gcx.offset + size
 
-                case GclCode.CALL.value:
+        command_id = self.gcx.read_short()
+        self.commands_stack.append( command_id )
 
-                    size = self.gcx.read_byte() - 1
-                    end_offset = self.gcx.offset + size
-                    proc_id = str( self.gcx.read_short() )
+        args_size = self.gcx.read_byte() - 1
+        args_end = self.gcx.offset + args_size
+        args = []
+        while True:
+            code = self.gcx.read_byte( self.gcx.offset )
+            if not code:
+                break
+            arg = yield self.decode_node
+            if not arg:
+                break
+            args.append( arg )
+
+        # Checks if no braces "{}" were used in "if" declaration
+        if command_id == IF_COMMAND and args_end - self.gcx.offset == 0:
+            args[1]['NO_BRACES'] = True
+
+        options = []
+        while self.gcx.offset < end_offset:
+            option = yield self.decode_node
+            if not option:
+                break
+            options.append( option )
+
+        self.commands_stack.pop()
 
-                    proc_args = []
-                    while self.gcx.offset < end_offset:
-                        arg = self.decompile_gcx()
-                        if not arg:
-                            break
-                        proc_args.append( arg )
+        return GclNode({ CMD_NAME: GclNode({ GCL_COMMAND_NAMES[ command_id ]: args + options }) })
 
-                    value = GclNode({ proc_id: proc_args })
+    def decode_call(self):
+        ''' Decode CALL block (decoding frame) '''
 
-                case _:
-                    print(f'Error: unexpected default case (GclCode: {gcl_code}, value: {value}, offset: {self.gcx.offset})')
-                    sys.exit(1)
+        size = self.gcx.read_byte() - 1
+        end_offset = self.gcx.offset + size
+        proc_id = str( self.gcx.read_short() )
 
-        return GclNode({ GclCode( gcl_code ).name: value })
+        proc_args = []
+        while self.gcx.offset < end_offset:
+            arg = yield self.decode_node
+            if not arg:
+                break
+            proc_args.append( arg )
 
-    def indent_text(self, text) -> str:
-        ''' Indent text block '''
+        return GclNode({ CALL_NAME: GclNode({ proc_id: proc_args }) })
 
-        return textwrap.indent( text, 4 * ' ' )
+    # Opcode to decoder table, filled once the class is defined.
+    # Leaf decoders return the node value, the others return a decoding frame.
+    decoders = {}
 
     def decomp_script(self, node) -> str:
         ''' Convert json AST to GCL script '''
 
-        s = ''
+        writer = ScriptWriter()
+        self.write_script( node, writer )
+        return writer.getvalue()
+
+    def write_script(self, node, writer):
+        ''' Write json AST as GCL script '''
 
         if 'FONTS' in node:
-            s += '#' + ('-' * 79) + '\n'
-            s += '# Font glyphs\n\n'
-            s += '['
+            writer.write( '#' + ('-' * 79) + '\n' )
+            writer.write( '# Font glyphs\n\n' )
+            writer.write( '[' )
+            glyph_table = self.glyph_table or GlyphTable()
             for i, font in enumerate( node['FONTS'] ):
-                s += f'\n    "{font}"'
+                writer.write( f'\n    "{glyph_table.resolve( font )}"' )
                 if i != len( node['FONTS'] ):
-                    s += ','
-            s += '\n]\n'
-            return s
+                    writer.write( ',' )
+            writer.write( '\n]\n' )
+            return
 
         elif 'PROC_DATA' in node:
             if node['PROC_ID'] == 0:
-                s += '#' + ('-' * 79) + '\n'
-                s += '# Main procedure\n\n'
-
-            # Browse procedure to find out how many arguments are used.
-            self.max_arg_index = 0
-            def check_arg( arg_type, arg_value ):
-                if arg_type == GclCode.ARG.name and arg_value > self.max_arg_index:
-                    self.max_arg_index = arg_value
-            node['PROC_DATA'].browse( check_arg )
+                writer.write( '#' + ('-' * 79) + '\n' )
+                writer.write( '# Main procedure\n\n' )
+
+            # Arguments used by the procedure are counted while decoding, trees
+            # not fully decoded (lazy mode) or from elsewhere are browsed.
+            max_arg_index = self.proc_args.get( node['PROC_ID'] )
+            if self.lazy or max_arg_index is None:
+                self.max_arg_index = 0
+                def check_arg( arg_type, arg_value ):
+                    if arg_type == GclCode.ARG.name:
+                        self.check_arg( arg_type, arg_value )
+                node['PROC_DATA'].browse( check_arg )
+                max_arg_index = self.max_arg_index
 
             args = ''
-            for index in range( self.max_arg_index ):
+            for index in range( max_arg_index ):
                 args += ' arg%d' % ( index+1 )
-                if index+1 != self.max_arg_index:
+                if index+1 != max_arg_index:
                     args += ','
                 else:
                     args += ' '
 
-            s += 'proc %s_%04X(%s) ' % ( DEFAULT_PROCEDURE_PREFIX, node['PROC_ID'], args )
-            s += self.decomp_script( node['PROC_DATA'] )
-            s += '\n'
-            return s
+            writer.write( 'proc %s_%04X(%s) ' % ( DEFAULT_PROCEDURE_PREFIX, node['PROC_ID'], args ) )
+            self.write_script( node['PROC_DATA'], writer )
+            writer.write( '\n' )
+            return
 
         node_type, value = node.get()
 
@@ -346,65 +485,64 @@ class GclDecomp:
 
             case GclCode.WORD.name:
 
-                s += '%d' % value
+                writer.write( '%d' % value )
 
             case GclCode.BYTE.name:
 
-                s += 'b:%d' % value
+                writer.write( 'b:%d' % value )
 
             case GclCode.CHAR.name:
 
-                s += "'%c'" % value
+                writer.write( "'%c'" % value )
 
             case GclCode.FLAG.name:
 
-                s += 'f:%r' % value
+                writer.write( 'f:%r' % value )
 
             case GclCode.STR_ID.name:
 
-                s += 's:%04x' % value
+                writer.write( 's:%04x' % value )
 
             case GclCode.STR.name:
 
-                s += '"%s"' % value
+                writer.write( '"%s"' % value )
 
             case GclCode.PROC.name:
 
-                s += '%s_%04X' % ( DEFAULT_PROCEDURE_PREFIX, value )
+                writer.write( '%s_%04X' % ( DEFAULT_PROCEDURE_PREFIX, value ) )
 
             case GclCode.SD_CODE.name:
 
-                s += 'sd:%X' % value
+                writer.write( 'sd:%X' % value )
 
             case GclCode.TABLE.name:
 
                 if isinstance( value, str ):
-                    s += 't:%s' % value
+                    writer.write( 't:%s' % value )
                 else:
-                    s += 't:%08X' % value
+                    writer.write( 't:%08X' % value )
 
             case GclCode.VAR.name:
 
                 var_type, var_value = value.get()
-                s += '$%s:%s' % ( var_type[0].lower(), var_value )
+                writer.write( '$%s:%s' % ( var_type[0].lower(), var_value ) )
 
             case GclCode.ARG.name:
 
-                s += 'arg%d' % value
+                writer.write( 'arg%d' % value )
 
             case GclCode.EXPR.name:
 
-                parentheses = False
-                expression = ''
+                # Expressions are short, render them apart to check parentheses.
+                expression = ScriptWriter()
                 for op in value:
-                    expression += self.decomp_script( op )
-                if len( value ) == 1 and not expression.startswith('('):
-                    parentheses = True
+                    self.write_script( op, expression )
+                expression = expression.getvalue()
 
-                if parentheses:
-                    s = f'( {expression} )'
+                if len( value ) == 1 and not expression.startswith('('):
+                    writer.write( f'( {expression} )' )
                 else:
-                    s = expression
+                    writer.write( expression )
 
             case GclCode.OP.name:
 
@@ -414,7 +552,8 @@ class GclDecomp:
                 # Single operand operation
                 if GclOperator[op_type].value < 4:
                     # @todo: remove first useless operand
-                    s += operator + self.decomp_script( operands[1] )
+                    writer.write( operator )
+                    self.write_script( operands[1], writer )
                 # Double operands operation
                 else:
                     parentheses = False
@@ -425,39 +564,44 @@ class GclDecomp:
                             parentheses = True
 
                     if parentheses:
-                        s += '( '
-                    s += self.decomp_script( operands[0] )
-                    s += ' ' + operator + ' '
-                    s += self.decomp_script( operands[1] )
+                        writer.write( '( ' )
+                    self.write_script( operands[0], writer )
+                    writer.write( ' ' + operator + ' ' )
+                    self.write_script( operands[1], writer )
                     if parentheses:
-                        s += ' )'
+                        writer.write( ' )' )
 
             case GclCode.SCRIPT.name:
 
                 if not 'NO_BRACES' in node:
-                    s += '{'
-                s += '\n'
+                    writer.write( '{' )
+                writer.write( '\n' )
                 for command_or_call in value:
-                    s += self.indent_text( self.decomp_script( command_or_call ) )
+                    writer.indent()
+                    self.write_script( command_or_call, writer )
+                    writer.dedent()
                 if not 'NO_BRACES' in node:
-                    s += '}'
-                s += '\n'
+                    writer.write( '}' )
+                writer.write( '\n' )
 
             case GclCode.OPTION.name:
 
                 option_letter, option_args = value.get()
-                s += '\n' + self.indent_text( '-' + option_letter )
+                writer.write( '\n' )
+                writer.indent()
+                writer.write( '-' + option_letter )
+                writer.dedent()
 
-                option_values = ''
+                writer.indent()
                 for arg in option_args:
-                    option_values += ' ' + self.decomp_script( arg )
-
-                s += self.indent_text( option_values )
+                    writer.write( ' ' )
+                    self.write_script( arg, writer )
+                writer.dedent()
 
             case GclCode.CMD.name:
 
                 command_name, command_args = value.get()
-                s += command_name.lower()
+                writer.write( command_name.lower() )
 
                 for arg in command_args:
 
@@ -465,34 +609,54 @@ class GclDecomp:
                     if command_name == GclCommands.IF.name and arg_type == GclCode.OPTION.name:
                         if_type, if_value = arg_value.get()
                         if if_type == 'i':
-                            s = s[:-1] + ' elseif '
-                            s += self.decomp_script( if_value[0] )
-                            s += ' '
-                            s += self.decomp_script( if_value[1] )
+                            writer.retract()
+                            writer.write( ' elseif ' )
+                            self.write_script( if_value[0], writer )
+                            writer.write( ' ' )
+                            self.write_script( if_value[1], writer )
                         elif if_type == 'e':
-                            s = s[:-1] + ' else '
-                            s += self.decomp_script( if_value[0] )
+                            writer.retract()
+                            writer.write( ' else ' )
+                            self.write_script( if_value[0], writer )
                         continue
                     if command_name == GclCode.STR.name:
-                        s += '\n'
+                        writer.write( '\n' )
 
-                    end_spacing = ' '
-                    if command_name == GclCommands.EVAL.name or arg_type == GclCode.OPTION.name:
-                        end_spacing = ''
-                    s += end_spacing + self.decomp_script( arg )
+                    if command_name != GclCommands.EVAL.name and arg_type != GclCode.OPTION.name:
+                        writer.write( ' ' )
+                    self.write_script( arg, writer )
 
-                s = s.strip() + '\n'
+                writer.rstrip()
+                writer.write( '\n' )
 
             case GclCode.CALL.name:
 
                 proc_id, proc_args = value.get()
-                s += f'call( {DEFAULT_PROCEDURE_PREFIX}_%04X' % int( proc_id )
+                writer.write( f'call( {DEFAULT_PROCEDURE_PREFIX}_%04X' % int( proc_id ) )
                 for proc_arg in proc_args:
-                    s += ', ' + self.decomp_script( proc_arg )
-                s += ' )\n'
+                    writer.write( ', ' )
+                    self.write_script( proc_arg, writer )
+                writer.write( ' )\n' )
 
             case _:
                 print(f'Unexpected node type {node_type} while building script..')
                 sys.exit(1)
 
-        return s
+GclDecomp.decoders.update({
+    GclCode.WORD.value:    GclDecomp.decode_word,
+    GclCode.BYTE.value:    GclDecomp.decode_byte,
+    GclCode.CHAR.value:    GclDecomp.decode_char,
+    GclCode.FLAG.value:    GclDecomp.decode_flag,
+    GclCode.STR_ID.value:  GclDecomp.decode_word,
+    GclCode.STR.value:     GclDecomp.decode_str,
+    GclCode.PROC.value:    GclDecomp.decode_word,
+    GclCode.SD_CODE.value: GclDecomp.decode_sd_code,
+    GclCode.TABLE.value:   GclDecomp.decode_table,
+    GclCode.ARG.value:     GclDecomp.decode_byte, # Procedure argument index (on the stack)
+    GclCode.EXPR.value:    GclDecomp.decode_expr,
+    GclCode.OP.value:      GclDecomp.decode_op,
+    GclCode.SCRIPT.value:  GclDecomp.decode_script,
+    GclCode.OPTION.value:  GclDecomp.decode_option,
+    GclCode.CMD.value:     GclDecomp.decode_cmd,
+    GclCode.CALL.value:    GclDecomp.decode_call,
+})
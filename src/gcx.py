@@ -1,6 +1,13 @@
 '''Handle gcx data'''
 import sys
+import json
 import struct
+import hashlib
+
+# Radio font glyphs are 36 bytes long, the 3 last bytes are 0 (or 0x14).
+GLYPH_SIZE = 36
+EMPTY_GLYPH = bytes( GLYPH_SIZE )
+GLYPH_TAIL_CHECK = bytes( 0 if i in ( 0, 0x14 ) else 1 for i in range( 256 ) )
 
 class GcxData(bytearray):
     ''' GCX bytecode buffer '''
@@ -77,6 +84,54 @@ class GcxData(bytearray):
             s += '%02x' % self.read_byte()
         return s
 
+    def read_glyphs(self):
+        ''' Read consecutive font glyphs to hex strings.
+
+            Glyphs are checked by chunks: the 3 last bytes of every glyph with
+            extended slices and the first empty glyph with a single search.
+            Reading stops before an invalid glyph or the last 36 bytes of the
+            buffer, and after the first empty glyph. '''
+
+        start = self.offset
+        # Glyphs must be followed by at least one byte.
+        count = max( 0, ( len( self ) - start - 1 ) // GLYPH_SIZE )
+        glyphs = 0
+        empty = False
+        chunk = 64
+        while glyphs < count:
+            size = min( chunk, count - glyphs )
+            begin = start + glyphs * GLYPH_SIZE
+            end = begin + size * GLYPH_SIZE
+
+            valid = size
+            for i in range( GLYPH_SIZE - 3, GLYPH_SIZE ):
+                invalid = self[begin+i:end:GLYPH_SIZE].translate( GLYPH_TAIL_CHECK ).find( 1 )
+                if invalid != -1 and invalid < valid:
+                    valid = invalid
+
+            offset = begin
+            end = begin + valid * GLYPH_SIZE
+            while True:
+                offset = self.find( EMPTY_GLYPH, offset, end )
+                if offset == -1 or ( offset - begin ) % GLYPH_SIZE == 0:
+                    break
+                offset += GLYPH_SIZE - ( offset - begin ) % GLYPH_SIZE
+
+            if offset != -1:
+                glyphs += ( offset - begin ) // GLYPH_SIZE
+                empty = True
+                break
+            glyphs += valid
+            if valid < size:
+                break
+            chunk *= 2
+
+        self.offset = start + glyphs * GLYPH_SIZE
+        glyphs_hex = self[start:self.offset].hex()
+        if empty:
+            self.offset += GLYPH_SIZE
+        return [ glyphs_hex[i:i+GLYPH_SIZE*2] for i in range( 0, len( glyphs_hex ), GLYPH_SIZE*2 ) ]
+
     #---------------------------------------------------------------------------
     # Write buffer
 
@@ -92,6 +147,18 @@ class GcxData(bytearray):
         ''' Append integer value to buffer '''
         self.extend( value.to_bytes(length=4, byteorder='big') )
 
+    def write_byte(self, offset, value):
+        ''' Overwrite byte value at offset '''
+        self[offset] = value & 0xff
+
+    def write_short(self, offset, value):
+        ''' Overwrite short value at offset '''
+        self[offset:offset+2] = value.to_bytes(length=2, byteorder='big')
+
+    def write_int(self, offset, value):
+        ''' Overwrite integer value at offset '''
+        self[offset:offset+4] = value.to_bytes(length=4, byteorder='big')
+
     def push_hex_string(self, value):
         ''' Append hex string value to buffer '''
         for i in range( int( len(value) / 2 ) ):
@@ -137,15 +204,111 @@ class GclNode(dict):
             node = self
         if 'PROC_DATA' in self:
             return self.browse( callback, node['PROC_DATA'] )
-        if isinstance( node, list ):
+        if isinstance( node, list ) or isinstance( node, GclLazyBlock ):
             for child in node:
                 self.browse( callback, child )
         elif isinstance( node, GclNode ):
             node_type, node_value = node.get()
             callback( node_type, node_value )
-            if isinstance( node_value, GclNode ) or isinstance( node_value, list ):
+            if isinstance( node_value, GclNode ) or isinstance( node_value, list ) \
+            or isinstance( node_value, GclLazyBlock ):
                 self.browse( callback, node_value )
 
+class GclLazyBlock():
+    ''' GCL block kept as a byte range and decoded on first access '''
+
+    def __init__(self, decomp, offset: int, end_offset: int, commands_stack: list) -> None:
+
+        self.decomp = decomp
+        self.offset = offset
+        self.end_offset = end_offset
+        self.commands_stack = commands_stack
+        self.data = None
+
+    def load(self) -> list:
+        ''' Decode block data if not done yet '''
+        if self.data is None:
+            self.data = self.decomp.decompile_block( self.offset, self.end_offset, self.commands_stack )
+            self.decomp = None
+        return self.data
+
+    def __iter__(self):
+        return iter( self.load() )
+
+    def __len__(self):
+        return len( self.load() )
+
+    def __getitem__(self, index):
+        return self.load()[index]
+
+def json_default(value):
+    ''' Serialize lazy blocks with json.dumps() '''
+    if isinstance( value, GclLazyBlock ):
+        return value.load()
+    raise TypeError( 'Object of type %s is not JSON serializable' % type( value ).__name__ )
+
+class GlyphTable():
+    ''' Interned font glyphs shared by radio dialogs and gcx files.
+        Trees reference glyphs by id (their index in the table). '''
+
+    def __init__(self, glyphs=[]) -> None:
+
+        self.glyphs = list( glyphs )
+        self.ids = { glyph: glyph_id for glyph_id, glyph in enumerate( self.glyphs ) }
+        self.digest_cache = ( 0, None )
+
+    def intern(self, glyph: str) -> int:
+        ''' Return glyph id, glyph is added to the table if needed '''
+
+        glyph_id = self.ids.get( glyph )
+        if glyph_id is None:
+            glyph_id = len( self.glyphs )
+            self.glyphs.append( glyph )
+            self.ids[glyph] = glyph_id
+        return glyph_id
+
+    def intern_all(self, glyphs) -> list:
+        ''' Return glyph ids of glyph list '''
+        return [ self.intern( glyph ) for glyph in glyphs ]
+
+    def resolve(self, glyph) -> str:
+        ''' Return glyph hex string from glyph id (hex strings are returned as is) '''
+
+        if not isinstance( glyph, int ):
+            return glyph
+        if glyph < 0 or glyph >= len( self.glyphs ):
+            print( 'Error: could not resolve glyph id %d' % glyph )
+            sys.exit(1)
+        return self.glyphs[glyph]
+
+    def digest(self) -> str:
+        ''' Return hash of glyph table (glyphs are only added, the hash is kept until then) '''
+
+        count, digest = self.digest_cache
+        if digest is None or count != len( self.glyphs ):
+            digest = hashlib.sha256( json.dumps( self.glyphs ).encode() ).hexdigest()
+            self.digest_cache = ( len( self.glyphs ), digest )
+        return digest
+
+    def load_json_file(self, path):
+        ''' Load glyph table from json file '''
+        try:
+            with open( path, 'r', encoding='utf-8' ) as f:
+                self.glyphs = json.loads( f.read() )
+        except OSError as err:
+            print( 'Error reading glyph table:', err )
+            sys.exit(1)
+        self.ids = { glyph: glyph_id for glyph_id, glyph in enumerate( self.glyphs ) }
+
+    def export_json(self, path):
+        ''' Export glyph table to json file '''
+        with open( path, 'w', encoding='utf-8' ) as f:
+            f.write( self.to_json() )
+
+    def to_json(self) -> str:
+        ''' Return glyph table in json format '''
+        return json.dumps( self.glyphs )
+
 class DatFile():
     ''' Handle files packed in .DAT files '''
 
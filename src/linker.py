@@ -0,0 +1,84 @@
+''' Relocatable gcx objects '''
+import os
+import sys
+import json
+
+from gcx import GcxData
+from gcl_compile import GLYPHS_SYMBOL, PC_VERSION_SYMBOL
+
+# Object format version, to be increased when objects change.
+VERSION = 1
+
+class GcxObject():
+    ''' Compiled gcx data with the offsets of its TABLE symbols (relocations).
+
+        Radio dialog calls, vox and demo block indexes are patched by link()
+        when their layout changes, without compiling the source again. The
+        glyph table and game version are part of the compiled data, the
+        source must be compiled again when they change. '''
+
+    def __init__(self, source_hash='', gcl=None) -> None:
+
+        self.source_hash = source_hash
+        self.gcx = GcxData()
+        self.relocations = []
+        # Symbols which can't be relocated, with their value
+        self.symbols = {}
+        if gcl is not None:
+            self.gcx = gcl.gcx
+            self.relocations = list( gcl.relocations )
+            self.symbols = { name: value for name, value in gcl.symbols.items()
+                             if name in ( GLYPHS_SYMBOL, PC_VERSION_SYMBOL ) }
+
+    def is_valid(self, source_hash, resolve_symbol) -> bool:
+        ''' Check if object was compiled from source with current glyphs and game version '''
+
+        if self.source_hash != source_hash:
+            return False
+        for name, value in self.symbols.items():
+            if resolve_symbol( name ) != value:
+                return False
+        return True
+
+    def link(self, resolve_symbol):
+        ''' Return gcx data with relocations patched, and symbols with their value.
+            resolve_symbol( name ) returns the current value of a symbol. '''
+
+        gcx = GcxData( self.gcx )
+        symbols = dict( self.symbols )
+        for offset, name in self.relocations:
+            value = symbols.get( name )
+            if value is None:
+                value = resolve_symbol( name )
+                if value is None:
+                    print( 'Error: could not resolve symbol', name )
+                    sys.exit(1)
+                symbols[name] = value
+            gcx.write_int( offset, value )
+        return gcx, symbols
+
+    def load_json_file(self, path) -> bool:
+        ''' Load object from json file.
+            Return False if there is no object or if it has another format. '''
+
+        if not os.path.isfile( path ):
+            return False
+        with open( path, 'r', encoding='utf-8' ) as f:
+            data = json.loads( f.read() )
+        if data.get( 'version' ) != VERSION:
+            return False
+        self.source_hash = data['source']
+        self.symbols = data['symbols']
+        self.relocations = [ ( offset, name ) for offset, name in data['relocations'] ]
+        self.gcx = GcxData( bytes.fromhex( data['gcx'] ) )
+        return True
+
+    def to_json(self) -> str:
+        ''' Return object in json format '''
+        return json.dumps({
+            'version':     VERSION,
+            'source':      self.source_hash,
+            'symbols':     self.symbols,
+            'relocations': self.relocations,
+            'gcx':         self.gcx.hex(),
+        })
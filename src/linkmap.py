@@ -0,0 +1,57 @@
+''' Link map of symbols used by stage compilation '''
+import sys
+import json
+
+from gcx import DatFile
+
+class LinkMap():
+    ''' Radio dialog calls, vox and demo block indexes of a full build.
+
+        Stage files can be compiled from the link map alone: it stands for
+        RadioComp in GclComp (dialog_calls and is_pc_version), and its vox
+        and demo files are DatFile objects without data. '''
+
+    def __init__(self) -> None:
+
+        self.dialog_calls = {}
+        self.is_pc_version = False
+        self.vox_files = []
+        self.demo_files = []
+
+    def set_build(self, radio, vox_files, demo_files):
+        ''' Set symbols from compiled radio and planned vox and demo files '''
+
+        self.dialog_calls = dict( radio.dialog_calls )
+        self.is_pc_version = radio.is_pc_version
+        self.vox_files = [ DatFile( vox_file.name, vox_file.offset, None ) for vox_file in vox_files ]
+        self.demo_files = [ DatFile( demo_file.name, demo_file.offset, None ) for demo_file in demo_files ]
+
+    def load_json_file(self, path):
+        ''' Load link map from json file '''
+
+        try:
+            with open( path, 'r', encoding='utf-8' ) as f:
+                data = json.loads( f.read() )
+        except OSError as err:
+            print( 'Error reading link map:', err )
+            sys.exit(1)
+        self.dialog_calls = data['dialogs']
+        self.is_pc_version = data['pc']
+        self.vox_files = [ DatFile( name, block_index * 0x800, None ) for name, block_index in data['vox'].items() ]
+        self.demo_files = [ DatFile( name, block_index * 0x800, None ) for name, block_index in data['demo'].items() ]
+
+    def to_json(self) -> str:
+        ''' Return link map in json format '''
+
+        vox_blocks = {}
+        for vox_file in self.vox_files:
+            vox_blocks.setdefault( vox_file.name, vox_file.block_index )
+        demo_blocks = {}
+        for demo_file in self.demo_files:
+            demo_blocks.setdefault( demo_file.name, demo_file.block_index )
+        return json.dumps({
+            'pc':      self.is_pc_version,
+            'dialogs': self.dialog_calls,
+            'vox':     vox_blocks,
+            'demo':    demo_blocks,
+        }, indent=1 )
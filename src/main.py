@@ -3,13 +3,21 @@ import json
 import sys
 import signal
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 from tests import Test
+from benchmark import Benchmark
+from cache import DecompCache
+from manifest import BuildManifest
+from file_io import OutputWriter, PrefetchReader, list_files, read_file
+from scheduler import TaskGraph
+from linkmap import LinkMap
+from linker import GcxObject
 from radio_decompile import RadioDecomp
 from radio_compile import RadioComp
-from gcx import GcxData, DatFile, GclNode
+from gcx import GcxData, GclNode, GlyphTable
 from gcl_decompile import GclDecomp
-from gcl_compile import GclComp
+from gcl_compile import GclComp, compile_gcl_source
 from demo_unpacker import DemoUnpacker
 from voice_unpacker import VoiceUnpacker
 
@@ -19,12 +27,29 @@ def signal_handler(sig, frame):
     sys.exit( 0 )
 signal.signal( signal.SIGINT, signal_handler )
 
+# Shared font glyphs table file (see --shared-glyphs)
+GLYPHS_FILE = 'GLYPHS.json'
+# RADIO.DAT dialogs index file
+RADIO_INDEX_FILE = 'RADIO_INDEX.json'
+# Compiled RADIO.DAT dialogs layout file (see --incremental)
+RADIO_LAYOUT_FILE = 'RADIO_LAYOUT.json'
+# Compiled gcx files manifest (see --force)
+BUILD_MANIFEST_FILE = 'BUILD_MANIFEST.json'
+# Radio, vox and demo symbols of last full compilation (see --only)
+LINK_MAP_FILE = 'LINK_MAP.json'
+# Relocatable gcx objects directory, linked again when only radio, vox or
+# demo layouts changed (see GcxObject)
+OBJECTS_DIR = 'OBJ'
+
 class Main():
     ''' Main class '''
 
     def __init__(self) -> None:
 
         self.init_args()
+        self.output = OutputWriter( threads=self.args.io_threads )
+        # Worker processes compiling gcl files (see --workers)
+        self.compile_pool = None
         self.process_args()
 
     def init_args(self):
@@ -41,10 +66,43 @@ class Main():
                             help='decompile game files from directory')
         group.add_argument('-c', '--compile', metavar='path',
                             help='compile game files from directory')
+        group.add_argument('-b', '--benchmark', metavar='path',
+                            help='compare iterative and recursive decoding' \
+                                 ' of the deepest procedures from directory')
+        group.add_argument('--patch-vox', metavar=('vox_dat', 'name', 'vox_file'), nargs=3,
+                            help='replace vox file name inside VOX.DAT by vox_file' \
+                                 ' without repacking it')
         self.parser.add_argument('-o', '--output', metavar='path',
                             help='output directory for exporting decompiled/recompiled files')
         self.parser.add_argument('--padding', action=argparse.BooleanOptionalAction, default=True,
                             help='add padding for radio dialogs inside RADIO.DAT')
+        self.parser.add_argument('-w', '--workers', metavar='count', type=int, default=1,
+                            help='number of worker processes for radio dialogs and gcl files')
+        self.parser.add_argument('-j', '--jobs', metavar='count', type=int, default=4,
+                            help='number of tasks run at the same time when' \
+                                 ' decompiling/compiling (1 to run them in order, default: 4)')
+        self.parser.add_argument('--io-threads', metavar='count', type=int, default=2,
+                            help='number of threads writing output files (0 to write them' \
+                                 ' while decompiling/compiling, default: 2)')
+        self.parser.add_argument('--read-ahead', metavar='count', type=int, default=4,
+                            help='number of stage files read ahead while decompiling' \
+                                 ' (0 to read them one at a time, default: 4)')
+        self.parser.add_argument('--incremental', action='store_true',
+                            help='only recompile radio dialogs changed since the' \
+                                 ' previous RADIO.DAT found in output directory')
+        self.parser.add_argument('--force', action='store_true',
+                            help='compile every gcl file, even if unchanged since' \
+                                 ' previous compilation (see %s)' % BUILD_MANIFEST_FILE)
+        self.parser.add_argument('--only', metavar='gcl_file', nargs='+',
+                            help='only compile these stage files, with radio, vox and demo' \
+                                 ' symbols of the previous full compilation (see %s)' % LINK_MAP_FILE)
+        self.parser.add_argument('--cache-dir', metavar='path',
+                            help='cache decompiled files in directory')
+        self.parser.add_argument('--cache-size', metavar='mb', type=int, default=512,
+                            help='maximum size of cache directory in mb (default: 512)')
+        self.parser.add_argument('--shared-glyphs', action='store_true',
+                            help='decompile font glyphs to a single shared table (%s)' \
+                                 ' referenced by id' % GLYPHS_FILE)
         self.args = self.parser.parse_args()
 
     def check_path(self, path):
@@ -56,7 +114,7 @@ class Main():
             print('Error: provided path "%s" is not a valid directory' % path)
             self.parser.print_usage()
             sys.exit(1)
-        elif self.args.test is None and self.args.output is None:
+        elif self.args.test is None and self.args.benchmark is None and self.args.output is None:
             print('Error: missing OUTPUT path argument.')
             self.parser.print_usage()
             sys.exit(1)
@@ -70,101 +128,191 @@ class Main():
             self.decompile( self.args.decompile, self.args.output )
         elif self.args.compile is not None and self.check_path( self.args.compile ):
             self.compile( self.args.compile, self.args.output )
+        elif self.args.benchmark is not None and self.check_path( self.args.benchmark ):
+            Benchmark().benchmark( self.args.benchmark )
+        elif self.args.patch_vox is not None:
+            self.patch_vox( *self.args.patch_vox )
+
+    def patch_vox(self, vox_dat, name, vox_file):
+        ''' Replace vox file inside VOX.DAT '''
+
+        if not os.path.isfile( vox_dat ):
+            print('Error: provided path "%s" is not a valid file' % vox_dat)
+            sys.exit(1)
+        moved = VoiceUnpacker().patch( vox_dat, name, read_file( vox_file ) )
+        for vox_name, ( old_block, new_block ) in moved.items():
+            print( 'Moved %s from block %d to block %d, radio and stage files using it' \
+                   ' must be compiled again.' % ( vox_name, old_block, new_block ) )
 
     def test_mgs_path(self, input_paths):
         ''' Test all provided paths '''
-        tests = Test()
+        tests = Test( cache=self.open_cache(), read_ahead=self.args.read_ahead )
         for input_path in input_paths:
             print( '- Testing "%s":' % (input_path) )
             tests.test( input_path, padding=self.args.padding )
 
+    def open_cache(self):
+        ''' Return decompiled data cache, None if not enabled '''
+        if self.args.cache_dir is None:
+            return None
+        return DecompCache( self.args.cache_dir, self.args.cache_size * 1024 * 1024 )
+
     def decompile(self, input_path, output_dir):
         ''' Decompile game files '''
 
         print( '- Decompiling "%s" to "%s"' % (input_path, output_dir) )
+        cache = self.open_cache()
+        glyph_table = GlyphTable() if self.args.shared_glyphs else None
+
+        # Decompilation tasks run as soon as the tasks they depend on are
+        # done: DEMO.DAT and VOX.DAT unpacking, RADIO.DAT once vox blocks are
+        # known (while unpacked files are written), then stages once dialog
+        # names are known. Stages are decompiled in order by a single task,
+        # so shared glyphs keep the same ids.
+        graph = TaskGraph( workers=self.args.jobs )
+        graph.add( 'demo', lambda: self.unpack( os.path.join( input_path, 'DEMO.DAT' ) ) )
+        graph.add( 'vox', lambda: self.unpack( os.path.join( input_path, 'VOX.DAT' ) ) )
+        graph.add( 'demo-files', lambda demo_files: \
+                                 self.write_files( demo_files, os.path.join( output_dir, 'DEMO' ) ),
+                   deps=[ 'demo' ] )
+        graph.add( 'vox-files', lambda vox_files: \
+                                self.write_files( vox_files, os.path.join( output_dir, 'VOX' ) ),
+                   deps=[ 'vox' ] )
+        graph.add( 'radio', lambda vox_files: \
+                            self.decompile_radio( input_path, output_dir, vox_files, glyph_table, cache ),
+                   deps=[ 'vox' ] )
+        graph.add( 'stage', lambda radio, vox_files, demo_files: \
+                            self.decompile_stages( input_path, output_dir, radio, vox_files, demo_files,
+                                                   glyph_table, cache ),
+                   deps=[ 'radio', 'vox', 'demo' ] )
+        graph.run()
+
+        if glyph_table is not None:
+            self.output.write( os.path.join( output_dir, GLYPHS_FILE ), glyph_table.to_json() )
+        if cache is not None:
+            print( 'Cache: %d hits, %d misses' % ( cache.hits, cache.misses ) )
+        self.output.close()
+        self.output.report()
 
-        # Unpack DEMO.DAT and VOX.DAT
-        demo_files = self.unpack( os.path.join( input_path, 'DEMO.DAT' ),
-                                  os.path.join( output_dir, 'DEMO' ) )
-        vox_files = self.unpack( os.path.join( input_path, 'VOX.DAT' ),
-                                 os.path.join( output_dir, 'VOX' ) )
+    def decompile_radio(self, input_path, output_dir, vox_files, glyph_table, cache):
+        ''' Decompile RADIO.DAT to dialog files '''
 
-        # Decompile RADIO.DAT
         print( 'Decompiling radio...')
         radio = RadioDecomp( GcxData( os.path.join( input_path, 'RADIO.DAT' ) ),
                              padding=self.args.padding,
-                             vox_files=vox_files )
-        dialog_files = radio.to_json_files()
+                             vox_files=vox_files,
+                             glyph_table=glyph_table,
+                             eager=False )
+        found = False
+        if cache is not None:
+            radio_key, found = cache.load_into( radio )
+        if found:
+            dialogs = [ elem['DIALOG'] for elem in radio.tree_data ]
+        else:
+            dialogs = radio.iter_dialogs( workers=self.args.workers )
         radio_dir = os.path.join( output_dir, 'RADIO' )
-        if not os.path.isdir( radio_dir ):
-            os.makedirs( radio_dir )
-        for dialog_file in dialog_files:
-            file_path = os.path.join( radio_dir, dialog_file.name )
-            with open( file_path + '.json', 'w', encoding='utf-8' ) as f:
-                f.write( dialog_file.data )
-
-        # Decompile GCX files from stage directory
+        self.output.makedirs( radio_dir )
+        # Dialogs are written as soon as decompiled, then dropped (unless cached).
+        cached_dialogs = []
+        for dialog in dialogs:
+            file_path = os.path.join( radio_dir, dialog['NAME'] )
+            self.output.write( file_path + '.json', json.dumps( dialog ) )
+            if cache is not None and not found:
+                cached_dialogs.append( dialog )
+        if cache is not None and not found:
+            cache.store( radio_key, radio.to_cache( cached_dialogs ) )
+        self.output.write( os.path.join( output_dir, RADIO_INDEX_FILE ), radio.index_to_json() )
+        return radio
+
+    def decompile_stages(self, input_path, output_dir, radio, vox_files, demo_files, glyph_table, cache):
+        ''' Decompile GCX files from stage directory '''
+
         stage_dir = os.path.join( output_dir, 'STAGE' )
-        if not os.path.isdir( stage_dir ):
-            os.makedirs( stage_dir )
-        for subdir, _dirs, files in os.walk( os.path.join( input_path, 'STAGE' ) ):
-            for file in files:
-                if file.endswith( '.gcx' ):
-                    gcx_file = os.path.join( subdir, file )
-                    print('Decompiling gcx file: "%s"' % gcx_file)
-                    gcl = GclDecomp( GcxData( gcx_file ),
-                                     radio=radio,
-                                     vox_files=vox_files,
-                                     demo_files=demo_files )
-                    gcl.decompile_gcx_file()
-                    file_path = gcx_file.replace( input_path, output_dir ) \
-                                        .replace( 'a242.gcx', 'demo.gcx' ) \
-                                        .replace( 'ea54.gcx', 'scenerio.gcx' ) \
-                                        .replace( '.gcx', '' )
-                    if not os.path.isdir( os.path.dirname( file_path ) ):
-                        os.makedirs( os.path.dirname( file_path ) )
-                    with open( file_path + '.json', 'w', encoding='utf-8' ) as f:
-                        f.write( gcl.to_json() )
+        self.output.makedirs( stage_dir )
+        stage_files = list_files( os.path.join( input_path, 'STAGE' ), '.gcx' )
+        for gcx_file, gcx_data in PrefetchReader( stage_files, depth=self.args.read_ahead ):
+            print('Decompiling gcx file: "%s"' % gcx_file)
+            gcl = GclDecomp( GcxData( gcx_data ),
+                             radio=radio,
+                             vox_files=vox_files,
+                             demo_files=demo_files,
+                             glyph_table=glyph_table )
+            if cache is None:
+                gcl.decompile_gcx_file()
+            else:
+                cache.decompile( gcl, gcl.decompile_gcx_file )
+            file_path = gcx_file.replace( input_path, output_dir ) \
+                                .replace( 'a242.gcx', 'demo.gcx' ) \
+                                .replace( 'ea54.gcx', 'scenerio.gcx' ) \
+                                .replace( '.gcx', '' )
+            self.output.write( file_path + '.json', gcl.to_json() )
 
     def compile(self, input_path, output_dir):
         ''' Compile game files '''
 
         print( '- Compiling "%s" to "%s"' % (input_path, output_dir) )
+        if self.args.only is not None:
+            self.compile_only( input_path, output_dir, self.args.only )
+            return
 
-        # Pack demo and vos files
-        demo_files = self.pack( os.path.join( input_path, 'DEMO' ),
-                                os.path.join( output_dir, 'DEMO.DAT' ) )
-        vox_files = self.pack( os.path.join( input_path, 'VOX' ),
-                               os.path.join( output_dir, 'VOX.DAT' ) )
+        # Build tasks run as soon as the tasks they depend on are done:
+        # demo and vox layouts are planned from file sizes, then files are
+        # packed while radio is compiled with vox blocks, then every gcl file
+        # is compiled once radio calls are known. Task threads overlap file
+        # reads and writes, gcl files are compiled in parallel by worker
+        # processes with --workers.
+        graph = TaskGraph( workers=self.args.jobs )
+        demo_dir = os.path.join( input_path, 'DEMO' )
+        vox_dir = os.path.join( input_path, 'VOX' )
+        graph.add( 'demo', lambda: self.plan_pack( demo_dir ) )
+        graph.add( 'vox', lambda: self.plan_pack( vox_dir ) )
+        graph.add( 'demo-pack', lambda demo_files: \
+                                self.pack( demo_dir, os.path.join( output_dir, 'DEMO.DAT' ), demo_files ),
+                   deps=[ 'demo' ] )
+        graph.add( 'vox-pack', lambda vox_files: \
+                               self.pack( vox_dir, os.path.join( output_dir, 'VOX.DAT' ), vox_files ),
+                   deps=[ 'vox' ] )
+        graph.add( 'glyphs', lambda: self.load_glyph_table( input_path ) )
+        graph.add( 'radio', lambda vox_files, glyph_table: \
+                            self.compile_radio( input_path, output_dir, vox_files, glyph_table ),
+                   deps=[ 'vox', 'glyphs' ] )
+        graph.add( 'link', lambda radio, vox_files, demo_files: self.link_map( radio, vox_files, demo_files ),
+                   deps=[ 'radio', 'vox', 'demo' ] )
 
-        # Compile dialog files
-        print( 'Compiling radio...')
-        radio = RadioComp( vox_files=vox_files )
-        radio_dir = os.path.join( input_path, 'RADIO' )
-        radio_data = []
-        for dialog_file in os.listdir( radio_dir ):
-            json_data = self.read_json_file( os.path.join( radio_dir, dialog_file ) )
-            radio_data.append( GclNode({ 'DIALOG': json_data }) )
-        radio.compile_radio_file( radio_data )
-        with open( radio_dir.replace( input_path, output_dir ) + '.DAT', 'wb' ) as f:
-            f.write( radio.gcx )
-
-        # Compile gcl files
-        for subdir, _dirs, files in os.walk( os.path.join( input_path, 'stage' ) ):
-            for file in files:
-                if file.endswith( '.json' ):
-                    gcl_file = os.path.join( subdir, file )
-                    print('Compiling gcl file: "%s"' % gcl_file)
-                    gcl = GclComp( radio=radio, vox_files=vox_files, demo_files=demo_files )
-                    gcl.compile_gcl_file( self.read_json_file( gcl_file ) )
-                    file_path = gcl_file.replace( input_path, output_dir ) \
-                                        .replace( 'demo.json', 'a242.json' ) \
-                                        .replace( 'scenerio.json', 'ea54.json' ) \
-                                        .replace( '.json', '' )
-                    if not os.path.isdir( os.path.dirname( file_path ) ):
-                        os.makedirs( os.path.dirname( file_path ) )
-                    with open( file_path + '.gcx', 'wb' ) as f:
-                        f.write( gcl.gcx )
+        # Compile gcl files changed since previous compilation
+        manifest = BuildManifest( os.path.join( output_dir, BUILD_MANIFEST_FILE ) )
+        stage_tasks = []
+        for gcl_file in list_files( os.path.join( input_path, 'stage' ), '.json' ):
+            read_task = graph.add( 'read:' + gcl_file, lambda gcl_file=gcl_file: read_file( gcl_file ) )
+            stage_tasks.append( graph.add( 'compile:' + gcl_file,
+                lambda source, link_map, glyph_table, gcl_file=gcl_file: \
+                    self.compile_gcl( input_path, output_dir, gcl_file, source, manifest,
+                                      link_map, glyph_table ),
+                deps=[ read_task, 'link', 'glyphs' ] ) )
+        if self.args.workers > 1:
+            with ProcessPoolExecutor( max_workers=self.args.workers ) as self.compile_pool:
+                graph.run()
+            self.compile_pool = None
+        else:
+            graph.run()
+
+        # Manifest entries in stage files order
+        skipped = 0
+        for task in stage_tasks:
+            source_name, source_hash, gcl = graph.result( task )
+            if gcl is None:
+                manifest.keep( source_name )
+                skipped += 1
+            else:
+                manifest.update( source_name, source_hash, gcl.symbols, gcl.gcx )
+        self.output.write( manifest.path, manifest.to_json() )
+        if skipped > 0:
+            print( 'Skipped %d unchanged gcl files.' % skipped )
+
+        # Symbols needed to compile stage files alone
+        self.output.write( os.path.join( output_dir, LINK_MAP_FILE ), graph.result( 'link' ).to_json() )
+        self.output.close()
+        self.output.report()
 
         #import hashlib
         #input_path = 'C:/Projects/mgs_compilation_tools/gcx_files/PSX_SLPM-86247'
@@ -194,17 +342,134 @@ class Main():
         #        total += 1
         #print('matches %d/%d' % (matches, total))
 
+    def compile_only(self, input_path, output_dir, gcl_files):
+        ''' Compile some gcl files with the link map of previous full compilation '''
+
+        link_map_path = os.path.join( output_dir, LINK_MAP_FILE )
+        if not os.path.isfile( link_map_path ):
+            print( 'Error: link map "%s" not found, compile all files first' % link_map_path )
+            sys.exit(1)
+        link_map = LinkMap()
+        link_map.load_json_file( link_map_path )
+        glyph_table = self.load_glyph_table( input_path )
+
+        manifest = BuildManifest( os.path.join( output_dir, BUILD_MANIFEST_FILE ) )
+        manifest.keep_previous()
+        skipped = 0
+        for gcl_file in gcl_files:
+            # Paths are relative to input directory or to current directory
+            if not os.path.isfile( gcl_file ):
+                gcl_file = os.path.join( input_path, gcl_file )
+            source_name = os.path.relpath( gcl_file, input_path )
+            if not os.path.isfile( gcl_file ) or source_name.startswith( '..' ):
+                print( 'Error: gcl file "%s" not found in "%s"' % (gcl_file, input_path) )
+                sys.exit(1)
+            gcl_file = os.path.join( input_path, source_name )
+            source_name, source_hash, gcl = self.compile_gcl( input_path, output_dir, gcl_file,
+                                                              read_file( gcl_file ), manifest,
+                                                              link_map, glyph_table )
+            if gcl is None:
+                skipped += 1
+            else:
+                manifest.update( source_name, source_hash, gcl.symbols, gcl.gcx )
+        self.output.write( manifest.path, manifest.to_json() )
+        if skipped > 0:
+            print( 'Skipped %d unchanged gcl files.' % skipped )
+        self.output.close()
+        self.output.report()
+
+    def load_glyph_table(self, input_path):
+        ''' Load shared glyph table, None if not found '''
+
+        glyphs_path = os.path.join( input_path, GLYPHS_FILE )
+        if not os.path.isfile( glyphs_path ):
+            return None
+        glyph_table = GlyphTable()
+        glyph_table.load_json_file( glyphs_path )
+        return glyph_table
+
+    def compile_radio(self, input_path, output_dir, vox_files, glyph_table):
+        ''' Compile dialog files to RADIO.DAT '''
+
+        print( 'Compiling radio...')
+        radio = RadioComp( vox_files=vox_files, glyph_table=glyph_table )
+        radio_dir = os.path.join( input_path, 'RADIO' )
+        radio_data = []
+        for dialog_file in os.listdir( radio_dir ):
+            json_data = self.read_json_file( os.path.join( radio_dir, dialog_file ) )
+            radio_data.append( GclNode({ 'DIALOG': json_data }) )
+        radio_path = radio_dir.replace( input_path, output_dir ) + '.DAT'
+        layout_path = os.path.join( output_dir, RADIO_LAYOUT_FILE )
+        if self.args.incremental and os.path.isfile( radio_path ) and os.path.isfile( layout_path ):
+            with open( layout_path, 'r', encoding='utf-8' ) as f:
+                layout = json.loads( f.read() )
+            changed_calls = radio.update_radio_file( radio_data, GcxData( radio_path ), layout,
+                                                     workers=self.args.workers )
+            if changed_calls:
+                print( 'Radio calls changed:', ', '.join( changed_calls ) )
+        else:
+            radio.compile_radio_file( radio_data, workers=self.args.workers )
+        self.output.write( radio_path, radio.gcx )
+        self.output.write( layout_path, radio.layout_to_json() )
+        return radio
+
+    def link_map(self, radio, vox_files, demo_files):
+        ''' Return symbols of compiled radio and planned vox and demo files '''
+
+        link_map = LinkMap()
+        link_map.set_build( radio, vox_files, demo_files )
+        return link_map
+
+    def compile_gcl(self, input_path, output_dir, gcl_file, source, manifest, link_map, glyph_table):
+        ''' Compile gcl file unless up to date, return ( source name, source hash, GclComp or None ).
+            The file is compiled by a worker process if there are --workers. '''
+
+        file_path = gcl_file.replace( input_path, output_dir ) \
+                            .replace( 'demo.json', 'a242.json' ) \
+                            .replace( 'scenerio.json', 'ea54.json' ) \
+                            .replace( '.json', '' )
+        source_name = os.path.relpath( gcl_file, input_path )
+        source_hash = manifest.hash( source )
+        gcl = GclComp( radio=link_map, vox_files=link_map.vox_files, demo_files=link_map.demo_files,
+                       glyph_table=glyph_table )
+        if not self.args.force and \
+           manifest.is_up_to_date( source_name, source_hash, file_path + '.gcx', gcl.resolve_symbol ):
+            return source_name, source_hash, None
+
+        # Unchanged source with other symbols values only needs to be linked
+        object_path = os.path.join( output_dir, OBJECTS_DIR, source_name )
+        gcx_object = GcxObject()
+        if not self.args.force and gcx_object.load_json_file( object_path ) \
+           and gcx_object.is_valid( source_hash, gcl.resolve_symbol ):
+            print('Linking gcl file: "%s"' % gcl_file)
+            gcl.gcx, gcl.symbols = gcx_object.link( gcl.resolve_symbol )
+        else:
+            print('Compiling gcl file: "%s"' % gcl_file)
+            if self.compile_pool is not None:
+                gcl.gcx, gcl.symbols, gcl.relocations = \
+                    self.compile_pool.submit( compile_gcl_source, source, link_map, glyph_table ).result()
+            else:
+                gcl.gcx, gcl.symbols, gcl.relocations = compile_gcl_source( source, link_map, glyph_table )
+            self.output.write( object_path, GcxObject( source_hash, gcl ).to_json() )
+        self.output.write( file_path + '.gcx', gcl.gcx )
+        return source_name, source_hash, gcl
+
     def read_json_file(self, json_path):
         ''' Read json file and convert it to tree data '''
 
         with open( json_path, 'r', encoding='utf-8' ) as f:
-            data = json.loads( f.read(), object_hook=GclNode )
-            if isinstance( data, dict ):
-                data = GclNode( data )
+            return self.parse_json( f.read() )
+
+    def parse_json(self, json_data):
+        ''' Convert json data to tree data '''
+
+        data = json.loads( json_data, object_hook=GclNode )
+        if isinstance( data, dict ):
+            data = GclNode( data )
         return data
 
-    def unpack(self, dat_path, output_dir):
-        ''' Unpack DAT file '''
+    def unpack(self, dat_path):
+        ''' Unpack DAT file, return its files '''
 
         if not os.path.isfile( dat_path ):
             return []
@@ -218,43 +483,50 @@ class Main():
             files = dat_file.vox_files
         else:
             return []
+        return files
 
-        if not os.path.isdir( output_dir ):
-            os.makedirs( output_dir )
+    def write_files(self, files, output_dir):
+        ''' Write unpacked files to output directory '''
+
+        if not files:
+            return
+        self.output.makedirs( output_dir )
         for file in files:
-            file_path = os.path.join( output_dir, file.name )
-            with open( file_path, 'wb' ) as f:
-                f.write( file.data )
-        return files
+            self.output.write( os.path.join( output_dir, file.name ), file.data )
 
-    def pack(self, input_dir, dat_path):
-        ''' Pack DAT file '''
+    def dat_packer(self, input_dir):
+        ''' Return DAT packer of directory, None if not packed '''
 
         if not os.path.isdir( input_dir ):
-            return []
+            return None
         if input_dir.endswith( 'DEMO' ):
-            dat_dir = DemoUnpacker()
-        elif input_dir.endswith( 'VOX' ):
-            dat_dir = VoiceUnpacker()
-        else:
+            return DemoUnpacker()
+        if input_dir.endswith( 'VOX' ):
+            return VoiceUnpacker()
+        return None
+
+    def plan_pack(self, input_dir):
+        ''' Return files of DAT file placed from their sizes, their data is read when packed '''
+
+        dat_dir = self.dat_packer( input_dir )
+        if dat_dir is None:
             return []
+        sizes = [ ( entry.name, entry.stat().st_size ) for entry in os.scandir( input_dir ) ]
+        return dat_dir.plan( sizes )
 
-        files = []
-        offset = 0
-        for file in os.listdir( input_dir ):
-            with open( os.path.join( input_dir, file ), 'rb' ) as f:
-                data = f.read()
-            files.append( DatFile( file, offset, data ) )
-            offset += len( data )
-            if input_dir.endswith( 'VOX' ):
-                offset += 0x800 - ( offset % 0x800 )
+    def pack(self, input_dir, dat_path, files):
+        ''' Pack DAT file from planned files '''
 
+        dat_dir = self.dat_packer( input_dir )
+        if dat_dir is None:
+            return
+        for file in files:
+            file.data = read_file( os.path.join( input_dir, file.name ) )
         dat_dir.pack( files )
-        if not os.path.isdir( os.path.dirname( dat_path ) ):
-            os.makedirs( os.path.dirname( dat_path ) )
-        with open( dat_path, 'wb' ) as f:
-            f.write( dat_dir.gcx )
-        return files
+        self.output.write( dat_path, dat_dir.gcx )
+        # Data is not needed anymore once written.
+        for file in files:
+            file.data = None
 
 if __name__ == '__main__':
 
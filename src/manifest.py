@@ -0,0 +1,64 @@
+''' Incremental build manifest '''
+import os
+import json
+import hashlib
+
+class BuildManifest():
+    ''' Hashes of sources and outputs of a previous build, with the
+        symbols resolved by every source and their values.
+
+        A source is up to date when its content did not change, when its
+        symbols still resolve to the same values and when its output file
+        was left untouched. '''
+
+    def __init__(self, path) -> None:
+
+        self.path = path
+        self.entries = {}
+        self.previous = {}
+        if os.path.isfile( path ):
+            with open( path, 'r', encoding='utf-8' ) as f:
+                self.previous = json.loads( f.read() )
+
+    def hash(self, data) -> str:
+        ''' Return data hash '''
+        return hashlib.sha256( data ).hexdigest()
+
+    def is_up_to_date(self, source, source_hash, output_path, resolve_symbol) -> bool:
+        ''' Check if source output is up to date.
+            resolve_symbol( name ) returns the current value of a symbol. '''
+
+        entry = self.previous.get( source )
+        if entry is None or entry['source'] != source_hash:
+            return False
+        for name, value in entry['symbols'].items():
+            if resolve_symbol( name ) != value:
+                return False
+        if not os.path.isfile( output_path ):
+            return False
+        with open( output_path, 'rb' ) as f:
+            if self.hash( f.read() ) != entry['output']:
+                return False
+        return True
+
+    def keep(self, source):
+        ''' Keep source entry of previous build (source is up to date) '''
+        self.entries[source] = self.previous[source]
+
+    def keep_previous(self):
+        ''' Keep all entries of previous build (only some sources are built) '''
+        self.entries.update( self.previous )
+
+    def update(self, source, source_hash, symbols, output):
+        ''' Set source entry from its compilation '''
+
+        self.entries[source] = {
+            'source':  source_hash,
+            'symbols': symbols,
+            'output':  self.hash( output ),
+        }
+
+    def to_json(self) -> str:
+        ''' Return manifest of current build in json format
+            (sources not built anymore are dropped) '''
+        return json.dumps( self.entries, indent=1 )
@@ -1,8 +1,10 @@
 import sys
 import os
 import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-from gcx import GcxData
+from gcx import GcxData, GlyphTable, DatFile
 from gcl_compile import GclComp
 from constants import RadioCode
 
@@ -12,13 +14,15 @@ class RadioComp():
     gcx = GcxData()
     gcl_comp = GclComp()
 
-    def __init__(self, padding=True, vox_files=[]) -> None:
+    def __init__(self, padding=True, vox_files=[], glyph_table=None) -> None:
 
         self.gcx = GcxData()
         self.dialog_calls = {}
+        self.layout = []
         self.vox_files = vox_files
         self.is_pc_version = len( vox_files ) == 0
         self.padding = padding
+        self.glyph_table = glyph_table or GlyphTable()
 
     def compile_json_files(self, radio_dir):
         ''' Compile the dialog.json files from radio_dir '''
@@ -31,32 +35,161 @@ class RadioComp():
                         radio_data = json.loads( f.read() )
                         self.compile_radio_file( radio_data )
 
-    def compile_radio_file(self, node):
-        ''' Compile data to RADIO.dat file '''
+    def compile_radio_file(self, node, workers=1):
+        ''' Compile data to RADIO.dat file.
+            Dialogs are compiled by a pool of worker processes if workers > 1,
+            then laid out one after another. '''
+
+        dialogs = [ elem['DIALOG'] for elem in node ]
+        if workers > 1:
+            # Workers only need voice names and block indexes.
+            vox_files = [ DatFile( vox_file.name, vox_file.offset, b'' ) for vox_file in self.vox_files ]
+            chunk_size = max( 1, len( dialogs ) // ( workers * 4 ) )
+            chunks = [ dialogs[i:i+chunk_size] for i in range( 0, len( dialogs ), chunk_size ) ]
+            with ProcessPoolExecutor( max_workers=workers,
+                                      initializer=init_dialog_worker,
+                                      initargs=( vox_files, self.glyph_table ) ) as executor:
+                dialogs_data = [ data for chunk in executor.map( compile_dialogs, chunks ) for data in chunk ]
+        else:
+            dialogs_data = map( self.compile_dialog, dialogs )
+
+        data = self.layout_dialogs( dialogs, dialogs_data )
+        self.gcx.extend( data )
+        return data
+
+    def update_radio_file(self, node, radio_data: GcxData, layout: dict, workers=1) -> list:
+        ''' Compile data to RADIO.dat file, reusing radio_data compiled with layout.
+            Only changed dialogs are compiled: they are patched in place when
+            they still fit in their sectors, otherwise the following dialogs are moved.
+            Everything is compiled if the layout does not match the dialogs.
+            Return names of dialogs whose radio call changed. '''
+
+        dialogs = [ elem['DIALOG'] for elem in node ]
+        entries = layout.get( 'dialogs', [] )
+        old_calls = self.layout_calls( entries )
+        if layout.get( 'sha256' ) != hashlib.sha256( radio_data ).hexdigest() \
+        or layout.get( 'padding' ) != self.padding \
+        or layout.get( 'vox' ) != self.vox_hash() \
+        or [ dialog['NAME'] for dialog in dialogs ] != [ entry['name'] for entry in entries ]:
+            self.compile_radio_file( node, workers )
+        else:
+            self.gcx.extend( self.patch_dialogs( dialogs, radio_data, entries ) )
+        return [ name for name, call in self.dialog_calls.items() if old_calls.get( name ) != call ]
+
+    def patch_dialogs(self, dialogs, radio_data, entries) -> GcxData:
+        ''' Replace changed dialogs of radio_data laid out as entries '''
+
+        data = GcxData( radio_data )
+        self.layout = []
+        moved = False
+        for dialog, entry in zip( dialogs, entries ):
+            dialog_hash = self.dialog_hash( dialog )
+            size = entry['size']
+            offset = len( data ) if moved else entry['offset']
+            if dialog_hash == entry['hash']:
+                if moved:
+                    data.extend( radio_data[entry['offset']:entry['offset']+size] )
+            else:
+                dialog_data = self.compile_dialog( dialog )
+                if self.padding:
+                    dialog_data.extend( bytes( -len( dialog_data ) % 0x800 ) )
+                # Still fits in its sectors: patched in place. Smaller dialogs are
+                # moved too, as an empty sector would be read as the next dialog.
+                if not moved and len( dialog_data ) == size:
+                    data[offset:offset+size] = dialog_data
+                else:
+                    # Following dialogs are moved.
+                    if not moved:
+                        del data[offset:]
+                        moved = True
+                    data.extend( dialog_data )
+                    size = len( dialog_data )
+            self.layout.append({
+                'name':   dialog['NAME'],
+                'offset': offset,
+                'size':   size,
+                'hash':   dialog_hash,
+            })
+
+        self.dialog_calls.update( self.layout_calls( self.layout ) )
+        return data
+
+    def dialog_hash(self, dialog) -> str:
+        ''' Return hash of dialog source (with resolved font glyphs) '''
+
+        source = dict( dialog )
+        source['FONTS'] = [ self.glyph_table.resolve( glyph ) for glyph in dialog['FONTS'] ]
+        return hashlib.sha256( json.dumps( source, sort_keys=True ).encode() ).hexdigest()
+
+    def vox_hash(self) -> str:
+        ''' Return hash of vox files names and offsets used by voice codes '''
+
+        vox_files = [ [ vox_file.name, vox_file.offset ] for vox_file in self.vox_files ]
+        return hashlib.sha256( json.dumps( vox_files ).encode() ).hexdigest()
+
+    def export_layout(self, path):
+        ''' Export dialogs layout of compiled data to json file '''
+        with open( path, 'w', encoding='utf-8' ) as f:
+            f.write( self.layout_to_json() )
+
+    def layout_to_json(self) -> str:
+        ''' Return dialogs layout of compiled data in json format '''
+
+        layout = {
+            'sha256':  hashlib.sha256( self.gcx ).hexdigest(),
+            'padding': self.padding,
+            'vox':     self.vox_hash(),
+            'dialogs': self.layout,
+        }
+        return json.dumps( layout )
+
+    def compile_dialog(self, dialog) -> GcxData:
+        ''' Compile dialog to GCX data (without padding) '''
+
+        dialog_data = GcxData()
+        dialog_data.push_short( dialog['FREQ'] )
+        dialog_data.push_byte( dialog['FACE_SIZE'] )
+        dialog_data.push_byte( 0 )
+        dialog_data.push_short( dialog['FACE_OFFSET'] )
+        dialog_data.push_short( 0 )
+        self.compile_radio( dialog['DATA'], dialog_data )
+        for glyph_image in dialog['FONTS']:
+            dialog_data.push_hex_string( self.glyph_table.resolve( glyph_image ) )
+        return dialog_data
+
+    def layout_dialogs(self, dialogs, dialogs_data) -> GcxData:
+        ''' Place compiled dialogs in RADIO.dat data and prepare radio calls '''
 
         data = GcxData()
+        self.layout = []
+        for dialog, dialog_data in zip( dialogs, dialogs_data ):
+            dialog_offset = len( data )
+            data.extend( dialog_data )
+            if self.padding:
+                data.extend( bytes( -len( data ) % 0x800 ) )
+            self.layout.append({
+                'name':   dialog['NAME'],
+                'offset': dialog_offset,
+                'size':   len( data ) - dialog_offset,
+                'hash':   self.dialog_hash( dialog ),
+            })
+
+        self.dialog_calls.update( self.layout_calls( self.layout ) )
+        return data
+
+    def layout_calls(self, layout) -> dict:
+        ''' Return radio calls of dialogs layout '''
+
+        dialog_calls = {}
 
         # If there is more than 500 dialogs we can assume the game has multi languages..
-        has_translation = len( node ) > 500
+        has_translation = len( layout ) > 500
         last_size = 0
         last_name = ''
 
-        for dialog_index, elem in enumerate( node ):
-            dialog = elem['DIALOG']
-            dialog_offset = len( data )
-            dialog_data = GcxData()
-            dialog_data.push_short( dialog['FREQ'] )
-            dialog_data.push_byte( dialog['FACE_SIZE'] )
-            dialog_data.push_byte( 0 )
-            dialog_data.push_short( dialog['FACE_OFFSET'] )
-            dialog_data.push_short( 0 )
-            dialog_data.extend( self.compile_radio( dialog['DATA'] ) )
-            for glyph_image in dialog['FONTS']:
-                dialog_data.push_hex_string( glyph_image )
-            if self.padding:
-                while (len( data ) + len( dialog_data )) % 0x800 != 0:
-                    dialog_data.push_byte( 0 )
-            data.extend( dialog_data )
+        for dialog_index, entry in enumerate( layout ):
+            dialog_offset = entry['offset']
+            dialog_size = entry['size']
 
             # Prepare radio calls required for recompiling gcl files.
             # First codec call ("This is snake, ..."):
@@ -67,145 +200,187 @@ class RadioComp():
             #       - 013B * 0x800 = jap_offset
             #       - jap_offset + jap_size = eng_offset
             offset = int( dialog_offset / 0x800 )
-            size = int( len( dialog_data ) / 0x800 )
+            size = int( dialog_size / 0x800 )
             if has_translation:
                 if ( dialog_index + 1 ) % 2 == 0:
                     call = '%02X%02X%04X' % ( last_size, size, offset - last_size )
-                    self.dialog_calls[last_name] = call      # First language (jap in integral)
-                    self.dialog_calls[dialog['NAME']] = call # Second language (eng in integral)
+                    dialog_calls[last_name] = call     # First language (jap in integral)
+                    dialog_calls[entry['name']] = call # Second language (eng in integral)
             else:
                 call = '%02X%02X%04X' % ( size, 0, offset )
-                self.dialog_calls[dialog['NAME']] = call
+                dialog_calls[entry['name']] = call
             last_size = size
-            last_name = dialog['NAME']
-
-        self.gcx.extend( data )
-        return data
-
-    def compile_radio(self, node):
-        ''' Compile data to GCX '''
-
-        data = GcxData()
-
-        if isinstance( node, list ):
-            for child in node:
-                data.extend( self.compile_radio( child ) )
-            return data
-
-        radio_type, value = node.get()
+            last_name = entry['name']
 
-        match radio_type:
+        return dialog_calls
 
-            case RadioCode.TALK.name:
+    def compile_radio(self, node, data=None):
+        ''' Compile data to GCX.
 
-                data.push_short( value[0] )
-                data.push_short( value[1] )
-                data.push_short( value[2] )
-                data.push_string( value[3] )
+            Same explicit stack walk as GclComp.compile_gcl, GCL parts are
+            compiled in place by the GCL compiler. '''
 
-            case RadioCode.VOICE.name:
+        if data is None:
+            data = GcxData()
 
-                voice_code, voice_data = value.get()
-                if not self.is_pc_version:
-                    voice_code = next((vox_file.block_index for vox_file in self.vox_files if vox_file.name == voice_code), '')
-                    if voice_code == '':
-                        print('Error: could not resolve voice code')
-                        sys.exit(1)
-                    data.push_int( voice_code )
-                else:
-                    voice_code = 'f' + voice_code[1:]
-                    data.push_int( int( voice_code, 16 ) )
-                data.extend( self.compile_radio( voice_data ) )
-
-            case RadioCode.ANIM.name:
-
-                data.push_short( value[0] )
-                data.push_short( value[1] )
-                data.push_short( value[2] )
-
-            case RadioCode.ADD_CONTACT.name:
-
-                frequency, name = value.get()
-                data.push_short( int( frequency ) )
-                data.push_string( name )
-
-            case RadioCode.MEMSAVE.name:
-
-                data.extend( self.gcl_comp.compile_gcl( value ) )
-                data.push_byte( 0 )
-
-            case RadioCode.SOUND.name:
-
-                data.push_hex_string( value )
-
-            case RadioCode.PROMPT.name:
-
-                data.extend( self.gcl_comp.compile_gcl( value ) )
-                data.push_byte( 0 )
-
-            case RadioCode.VARSAVE.name:
-
-                data.extend( self.gcl_comp.compile_gcl( value ) )
-                data.push_byte( 0 )
-
-            case RadioCode.IF.name:
-
-                data.extend( self.gcl_comp.compile_gcl( value[0] ) )
-                data.extend( self.compile_radio( value[1:] ) )
-                data.push_byte( 0 )
-
-            case RadioCode.ELSE.name:
-
-                data.push_byte( RadioCode.ELSE.value )
-                data.extend( self.compile_radio( value ) )
-                return data
-
-            case RadioCode.ELSEIF.name:
-
-                data.push_byte( RadioCode.ELSEIF.value )
-                data.extend( self.gcl_comp.compile_gcl( value[0] ) )
-                data.extend( self.compile_radio( value[1] ) )
-                return data
-
-            case RadioCode.SWITCH.name:
-
-                pass
-
-            case RadioCode.RANDSWITCH.name:
-
-                switch_value, switch_cases = value.get()
-                data.push_short( int( switch_value ) )
-                for case in switch_cases:
-                    case_value, case_data = case.get()
-                    data.push_byte( RadioCode.RANDSWITCH_CASE.value )
-                    data.push_short( int( case_value ) )
-                    data.extend( self.compile_radio( case_data ) )
-                data.push_byte( 0 )
-
-            case RadioCode.EVAL.name:
-
-                data.extend( self.gcl_comp.compile_gcl( value ) )
-
-            case RadioCode.RD_SCRIPT.name:
-
-                script_data = GcxData()
-                for elem in value:
-                    script_data.extend( self.compile_radio( elem ) )
-
-                data.extend( script_data )
-                data.push_byte( 0 )
-
-            case RadioCode.ENDLINE.name:
+        stack = [ node ]
+        while stack:
+            item = stack.pop()
+            if type( item ) is tuple:
+                action, arg, extra = item
+                action( self, data, stack, arg, extra )
+            elif isinstance( item, list ):
+                stack.extend( reversed( item ) )
+            else:
+                radio_type, value = item.get()
+                encoder = self.encoders.get( radio_type )
+                if encoder is None:
+                    print(f'Unexpected type {radio_type} while compiling radio..')
+                    sys.exit(1)
+                encoder( self, data, stack, radio_type, value )
 
-                data.push_byte( 0xFF )
-                return data
+        return data
 
-            case _:
-                print(f'Unexpected type {radio_type} while compiling radio..')
+    def start_block(self, data, stack, radio_type, end_byte=None):
+        ''' Write block code and reserve its size until the block end marker '''
+        data.push_byte( RadioCode[ radio_type ].value )
+        stack.append( ( RadioComp.end_block, len( data ), end_byte ) )
+        data.push_short( 0 )
+
+    def end_block(self, data, stack, size_offset, end_byte):
+        ''' Terminate block and write its size '''
+        if end_byte is not None:
+            data.push_byte( end_byte )
+        data.write_short( size_offset, len( data ) - size_offset )
+
+    def encode_talk(self, data, stack, radio_type, value):
+        ''' Encode TALK block '''
+        self.start_block( data, stack, radio_type )
+        data.push_short( value[0] )
+        data.push_short( value[1] )
+        data.push_short( value[2] )
+        data.push_string( value[3] )
+
+    def encode_voice(self, data, stack, radio_type, value):
+        ''' Encode VOICE block '''
+        voice_code, voice_data = value.get()
+        self.start_block( data, stack, radio_type )
+        if not self.is_pc_version:
+            voice_code = next((vox_file.block_index for vox_file in self.vox_files if vox_file.name == voice_code), '')
+            if voice_code == '':
+                print('Error: could not resolve voice code')
                 sys.exit(1)
-
-        _data = GcxData()
-        _data.push_byte( RadioCode[ radio_type ].value )
-        _data.push_short( len( data ) + 2 )
-        _data.extend( data )
-        return _data
+            data.push_int( voice_code )
+        else:
+            voice_code = 'f' + voice_code[1:]
+            data.push_int( int( voice_code, 16 ) )
+        stack.append( voice_data )
+
+    def encode_anim(self, data, stack, radio_type, value):
+        ''' Encode ANIM block '''
+        self.start_block( data, stack, radio_type )
+        data.push_short( value[0] )
+        data.push_short( value[1] )
+        data.push_short( value[2] )
+
+    def encode_add_contact(self, data, stack, radio_type, value):
+        ''' Encode ADD_CONTACT block '''
+        frequency, name = value.get()
+        self.start_block( data, stack, radio_type )
+        data.push_short( int( frequency ) )
+        data.push_string( name )
+
+    def encode_gcl_block(self, data, stack, radio_type, value):
+        ''' Encode MEMSAVE, PROMPT and VARSAVE blocks '''
+        self.start_block( data, stack, radio_type, 0 )
+        self.gcl_comp.compile_gcl( value, data )
+
+    def encode_sound(self, data, stack, radio_type, value):
+        ''' Encode SOUND block '''
+        self.start_block( data, stack, radio_type )
+        data.push_hex_string( value )
+
+    def encode_if(self, data, stack, radio_type, value):
+        ''' Encode IF block '''
+        self.start_block( data, stack, radio_type, 0 )
+        self.gcl_comp.compile_gcl( value[0], data )
+        stack.append( value[1:] )
+
+    def encode_else(self, data, stack, radio_type, value):
+        ''' Encode ELSE part of IF block (no size) '''
+        data.push_byte( RadioCode.ELSE.value )
+        stack.append( value )
+
+    def encode_elseif(self, data, stack, radio_type, value):
+        ''' Encode ELSEIF part of IF block (no size) '''
+        data.push_byte( RadioCode.ELSEIF.value )
+        self.gcl_comp.compile_gcl( value[0], data )
+        stack.append( value[1] )
+
+    def encode_switch(self, data, stack, radio_type, value):
+        ''' Encode SWITCH block (empty) '''
+        self.start_block( data, stack, radio_type )
+
+    def encode_randswitch(self, data, stack, radio_type, value):
+        ''' Encode RANDSWITCH block '''
+        switch_value, switch_cases = value.get()
+        self.start_block( data, stack, radio_type, 0 )
+        data.push_short( int( switch_value ) )
+        for case in reversed( switch_cases ):
+            case_value, case_data = case.get()
+            stack.append( case_data )
+            stack.append( ( RadioComp.encode_randswitch_case, case_value, None ) )
+
+    def encode_randswitch_case(self, data, stack, case_value, extra):
+        ''' Write RANDSWITCH case header before its data '''
+        data.push_byte( RadioCode.RANDSWITCH_CASE.value )
+        data.push_short( int( case_value ) )
+
+    def encode_eval(self, data, stack, radio_type, value):
+        ''' Encode EVAL block '''
+        self.start_block( data, stack, radio_type )
+        self.gcl_comp.compile_gcl( value, data )
+
+    def encode_script(self, data, stack, radio_type, value):
+        ''' Encode RD_SCRIPT block '''
+        self.start_block( data, stack, radio_type, 0 )
+        stack.append( value )
+
+    def encode_endline(self, data, stack, radio_type, value):
+        ''' Encode ENDLINE code '''
+        data.push_byte( 0xFF )
+
+    # Encoders write the block code and data, and push the block end marker
+    # and children on the compiling stack.
+    encoders = {}
+
+RadioComp.encoders.update({
+    RadioCode.TALK.name:        RadioComp.encode_talk,
+    RadioCode.VOICE.name:       RadioComp.encode_voice,
+    RadioCode.ANIM.name:        RadioComp.encode_anim,
+    RadioCode.ADD_CONTACT.name: RadioComp.encode_add_contact,
+    RadioCode.MEMSAVE.name:     RadioComp.encode_gcl_block,
+    RadioCode.SOUND.name:       RadioComp.encode_sound,
+    RadioCode.PROMPT.name:      RadioComp.encode_gcl_block,
+    RadioCode.VARSAVE.name:     RadioComp.encode_gcl_block,
+    RadioCode.IF.name:          RadioComp.encode_if,
+    RadioCode.ELSE.name:        RadioComp.encode_else,
+    RadioCode.ELSEIF.name:      RadioComp.encode_elseif,
+    RadioCode.SWITCH.name:      RadioComp.encode_switch,
+    RadioCode.RANDSWITCH.name:  RadioComp.encode_randswitch,
+    RadioCode.EVAL.name:        RadioComp.encode_eval,
+    RadioCode.RD_SCRIPT.name:   RadioComp.encode_script,
+    RadioCode.ENDLINE.name:     RadioComp.encode_endline,
+})
+
+# Radio compiler of a worker process
+worker_radio = None
+
+def init_dialog_worker(vox_files, glyph_table):
+    ''' Create the radio compiler of a worker process '''
+    global worker_radio
+    worker_radio = RadioComp( vox_files=vox_files, glyph_table=glyph_table )
+
+def compile_dialogs(dialogs) -> list:
+    ''' Compile dialogs (worker process) '''
+    return [ worker_radio.compile_dialog( dialog ) for dialog in dialogs ]
@@ -1,16 +1,38 @@
 import sys
 import json
 import os
-import textwrap
+import hashlib
+from types import GeneratorType
+from concurrent.futures import ProcessPoolExecutor
 
-from gcx import GclNode, GcxData, DatFile
+from gcx import GclNode, GcxData, DatFile, GlyphTable
+from decode_engine import decode, hooked_frame
 from gcl_decompile import GclDecomp
-from constants import RadioCode
+from script_writer import ScriptWriter
+from constants import RadioCode, RADIO_CODE_NAMES
+
+# Opcodes and names compared in the decoding loop.
+ENDLINE_CODE =         RadioCode.ENDLINE.value
+ELSE_CODE =            RadioCode.ELSE.value
+ELSEIF_CODE =          RadioCode.ELSEIF.value
+RANDSWITCH_CASE_CODE = RadioCode.RANDSWITCH_CASE.value
+VOICE_CODE =           RadioCode.VOICE.value
+IF_CODE =              RadioCode.IF.value
+RANDSWITCH_CODE =      RadioCode.RANDSWITCH.value
+RD_SCRIPT_CODE =       RadioCode.RD_SCRIPT.value
+ENDLINE_NAME =         RadioCode.ENDLINE.name
+VOICE_NAME =           RadioCode.VOICE.name
+IF_NAME =              RadioCode.IF.name
+ELSE_NAME =            RadioCode.ELSE.name
+ELSEIF_NAME =          RadioCode.ELSEIF.name
+RANDSWITCH_NAME =      RadioCode.RANDSWITCH.name
+EVAL_NAME =            RadioCode.EVAL.name
+RD_SCRIPT_NAME =       RadioCode.RD_SCRIPT.name
 
 class RadioDecomp():
     ''' Decompile radio.dat file '''
 
-    def __init__(self, gcx: GcxData, padding=True, vox_files={}) -> None:
+    def __init__(self, gcx: GcxData, padding=True, vox_files={}, glyph_table=None, workers=1, eager=True) -> None:
 
         self.gcx = gcx
         self.gcl_decomp = GclDecomp( gcx )
@@ -18,52 +40,83 @@ class RadioDecomp():
         self.is_pc_version = False
         self.vox_files = vox_files
         self.dialog_files = []
+        self.dialog_names = {}
+        self.dialog_records = []
+        # Decoding hooks by opcode, and highest voice id by dialog offset.
+        self.hooks = {}
+        self.voice_ids = {}
+        self.dialog_voice_id = -1
+        self.add_hook( VOICE_CODE, self.check_voice )
         self.padding = padding
-
-        self.decompile_radio_file()
-        self.resolve_dialog_filenames()
-
-    def export_script(self):
-        ''' Export script to file '''
-
-        script = ''
-        for elem in self.tree_data:
-            dialog = elem['DIALOG']
-            script += 'frequency: %.2f, ' % ( dialog['FREQ'] / 100 )
-            script += 'face_size: %d, ' % dialog['FACE_SIZE']
-            script += 'face_offset: %d ' % dialog['FACE_OFFSET']
-            script += self.decomp_script( dialog['DATA'] )
-            script += '\n'
-
-        with open('radio.gcl', 'w', encoding='utf-8') as f:
-            f.write( script )
+        # Fonts are stored as glyph ids when a shared glyph table is used.
+        self.glyph_table = glyph_table
+
+        if eager:
+            self.decompile_radio_file( workers )
+            self.resolve_dialog_filenames()
+
+    def export_script(self, path='radio.gcl', per_dialog=False, workers=1):
+        ''' Export script to file, or to one file per dialog in path directory.
+            Dialogs are rendered by a pool of worker processes if workers > 1. '''
+
+        dialogs = [ elem['DIALOG'] for elem in self.tree_data ]
+        if workers > 1:
+            with ProcessPoolExecutor( max_workers=workers ) as executor:
+                scripts = executor.map( render_dialog, dialogs, chunksize=max( 1, len( dialogs ) // ( workers * 4 ) ) )
+                self.write_scripts( dialogs, scripts, path, per_dialog )
+        else:
+            self.write_scripts( dialogs, map( self.render_dialog, dialogs ), path, per_dialog )
+
+    def write_scripts(self, dialogs, scripts, path, per_dialog):
+        ''' Write dialog scripts to file, or to one file per dialog in path directory '''
+
+        if per_dialog:
+            os.makedirs( path, exist_ok=True )
+            for dialog, script in zip( dialogs, scripts ):
+                with open( os.path.join( path, dialog['NAME'] + '.gcl' ), 'w', encoding='utf-8' ) as f:
+                    f.write( script )
+        else:
+            with open( path, 'w', encoding='utf-8' ) as f:
+                for script in scripts:
+                    f.write( script )
+
+    def render_dialog(self, dialog) -> str:
+        ''' Return dialog script '''
+
+        writer = ScriptWriter()
+        self.write_dialog( dialog, writer )
+        return writer.getvalue()
+
+    def write_dialog(self, dialog, writer):
+        ''' Write dialog header and script '''
+
+        writer.write( 'frequency: %.2f, ' % ( dialog['FREQ'] / 100 ) )
+        writer.write( 'face_size: %d, ' % dialog['FACE_SIZE'] )
+        writer.write( 'face_offset: %d ' % dialog['FACE_OFFSET'] )
+        self.write_script( dialog['DATA'], writer )
+        writer.write( '\n' )
 
     def resolve_dialog_filenames(self):
         ''' Attempt to retrieve the original dialog file names from VOX file names '''
 
+        # Highest scene id from voice filename(.vox) is found while decoding.
+        voice_ids = [ self.voice_ids[elem['DIALOG']['OFFSET']] for elem in self.tree_data ]
+        for elem, name in zip( self.tree_data, self.dialog_filenames( voice_ids ) ):
+            elem['DIALOG']['NAME'] = name
+            self.dialog_names[elem['DIALOG']['OFFSET']] = name
+
+    def dialog_filenames(self, voice_ids) -> list:
+        ''' Return dialog file names from the voice id found in every dialog '''
+
         extra_count = 0
         names = {}
-        for i, elem in enumerate( self.tree_data ):
-            dialog = elem['DIALOG']['DATA']
-
-            # Browse dialog to identify lowest scene id from voice filename(.vox).
-            self.lowest_vox_id = -1
-            def find_lowest_id(node_type, node_value):
-                if node_type == RadioCode.VOICE.name:
-                    voice_name, _ = node_value.get()
-                    try:
-                        voice_code = int( voice_name[2:].replace('.vox', ''), 16 )
-                        if self.lowest_vox_id == -1 or self.lowest_vox_id < voice_code:
-                            self.lowest_vox_id = voice_code
-                    except:
-                        pass
-            dialog.browse( find_lowest_id )
-
-            if self.lowest_vox_id == -1:
+        filenames = []
+        for i, voice_id in enumerate( voice_ids ):
+            if voice_id == -1:
                 extra_count += 1
                 name = 'RD_EXTRA_%0d' % extra_count
             else:
-                vc = '%08X' % ( self.lowest_vox_id << 8 )
+                vc = '%08X' % ( voice_id << 8 )
                 major_scene_id = vc[0:2]
                 minor_scene_id = vc[2:3]
                 # Uppercase identifier character.
@@ -74,8 +127,9 @@ class RadioDecomp():
                 name = 'RD_%s_%s%s' % ( major_scene_id, minor_scene_id, minor_scene_letter )
             # Lowercase identifier character.
             if name in names:
-                if not isinstance( names[name], int ):
-                    names[name]['NAME'] = names[name]['NAME'] + 'a'
+                if names[name] < 0:
+                    first = -names[name] - 1
+                    filenames[first] = filenames[first] + 'a'
                     names[name] = 0
                 names[name] += 1
                 if names[name] > 26:
@@ -83,8 +137,41 @@ class RadioDecomp():
                 else:
                     name += chr( ord('a') + names[name] )
             else:
-                names[name] = elem['DIALOG']
-            elem['DIALOG']['NAME'] = name.rstrip()
+                # Index of first dialog using the name, until it is used again.
+                names[name] = -i - 1
+            filenames.append( name.rstrip() )
+        return filenames
+
+    def add_hook(self, radio_code, hook):
+        ''' Call hook( node_type, node_value ) for every node of radio_code when decoded '''
+        self.hooks.setdefault( radio_code, [] ).append( hook )
+
+    def check_voice(self, node_type, node_value):
+        ''' Keep highest voice id of current dialog (decoding hook) '''
+        voice_name, _ = node_value.get()
+        voice_code = self.voice_id( voice_name )
+        if self.dialog_voice_id == -1 or self.dialog_voice_id < voice_code:
+            self.dialog_voice_id = voice_code
+
+    def voice_id(self, voice_name) -> int:
+        ''' Return scene id from voice file name, -1 if not found '''
+        try:
+            return int( voice_name[2:].replace('.vox', ''), 16 )
+        except ValueError:
+            return -1
+
+    def voice_name(self, voice_code) -> str:
+        ''' Return voice file name from voice code '''
+
+        # PC VOX filename
+        if voice_code >> 24 == 0xfc:
+            return 'vc%06x' % ( voice_code & 0xffffff )
+        # PSX VOX offset in VOX.DAT
+        voice_name = next((vox_file.name for vox_file in self.vox_files if vox_file.block_index == voice_code), '')
+        if voice_name == '':
+            print('Error: could not resolve voice code', hex(voice_code))
+            sys.exit(1)
+        return voice_name
 
     def export_json_files(self, output_dir):
         ''' Export a json file for each dialog in the output directory '''
@@ -115,294 +202,510 @@ class RadioDecomp():
     def to_gcl_script(self) -> str:
         ''' Return decompiled data in gcl script format '''
 
-        gcl = ''
+        writer = ScriptWriter()
         for elem in self.tree_data:
-            gcl += self.decomp_script( elem )
-        return gcl
-
-    def decompile_radio_file(self):
-        ''' Decompile radio file '''
-
-        file_size = len( self.gcx )
-
-        while self.gcx.offset < file_size:
-
-            dialog_offset = self.gcx.offset
-
-            frequency = self.gcx.read_short()
-            # In game, face size and offset is read as int and splitted with binary operations.
-            face_size = self.gcx.read_byte()
-            self.gcx.offset += 1
-            face_offset = self.gcx.read_short()
-            flags = self.gcx.read_short() # Always 0
-
-            # Dialog data need to be processed after fonts so we save offset.
-            dialog_data_offset = self.gcx.offset
-            dialog_data_size = self.gcx.read_short( self.gcx.offset + 1 )
-            self.gcx.offset += dialog_data_size + 1
-
-            fonts = []
-            while self.gcx.offset < file_size:
-                val = 0
-                font_offset = self.gcx.offset
-                for i in range( 36 ):
-                    # All fonts glyphs ends with three 0's except one font that ends with 001400.
-                    if i >= 33 and self.gcx.read_byte( self.gcx.offset ) != 0 \
-                               and self.gcx.read_byte( self.gcx.offset ) != 0x14:
-                        self.gcx.offset -= i
-                        val = 0
-                        break
-                    if self.gcx.offset + 1 == len( self.gcx ):
-                        self.gcx.offset -= i
-                        val = 0
-                        break
-                    val += self.gcx.read_byte()
-                if val == 0:
-                    break
-                self.gcx.offset = font_offset
-                font = self.gcx.read_hex_string( 36 )
-                fonts.append( font )
-            self.current_fonts = fonts
-
-            # Now go back for decompiling dialog data.
-            fonts_end_offset = self.gcx.offset
-            self.gcx.offset = dialog_data_offset
-            dialog_data = self.decompile()
-            self.gcx.offset = fonts_end_offset
-
-            if self.padding:
-                self.gcx.offset += ( 0x800 - ( self.gcx.offset % 0x800 ) )
-
-            dialog = GclNode({
-                'OFFSET':      dialog_offset, # Shouldn't be needed.
-                'FREQ':        frequency,
-                'FACE_SIZE':   face_size,
-                'FACE_OFFSET': face_offset,
-                'FLAGS':       flags,
-                'DATA':        dialog_data,
-                'FONTS':       fonts,
-                'NAME':        'rd_%03d' % ( int(dialog_offset / 0x800) )
-            })
+            self.write_script( elem, writer )
+        return writer.getvalue()
+
+    def decompile_radio_file(self, workers=1):
+        ''' Decompile radio file.
+            Dialogs are decoded by a pool of worker processes if workers > 1. '''
+
+        records = self.scan_dialogs()
+        for record, dialog in zip( records, self.decompile_dialogs( records, workers ) ):
+            if self.glyph_table is not None:
+                dialog['FONTS'] = self.glyph_table.intern_all( dialog['FONTS'] )
             self.tree_data.append( GclNode({ 'DIALOG': dialog }) )
-            self.dialog_files.append( DatFile( dialog['NAME'], dialog_offset, self.gcx[dialog_offset:self.gcx.offset] ) )
+            self.dialog_files.append( DatFile( dialog['NAME'], record['offset'], self.gcx[record['offset']:record['end_offset']] ) )
+            self.gcx.offset = record['end_offset']
+
+    def iter_dialogs(self, workers=1):
+        ''' Decompile dialogs one at a time, without keeping them.
+            Dialog names are resolved first from a skim of the dialogs voices,
+            so the yielded dialogs are complete. '''
+
+        records = self.index_dialogs()
+        for record, dialog in zip( records, self.decompile_dialogs( records, workers ) ):
+            dialog['NAME'] = record['name']
+            if self.glyph_table is not None:
+                dialog['FONTS'] = self.glyph_table.intern_all( dialog['FONTS'] )
+            yield dialog
+
+    def index_dialogs(self) -> list:
+        ''' Scan dialogs and resolve their names without decompiling them.
+            Return dialog records (see scan_dialog) with their name and size. '''
+
+        records = self.scan_dialogs()
+        voice_ids = [ self.scan_voice_id( record ) for record in records ]
+        for record, name in zip( records, self.dialog_filenames( voice_ids ) ):
+            record['name'] = name
+            record['size'] = record['end_offset'] - record['offset']
+            self.dialog_names[record['offset']] = name
+        self.dialog_records = records
+        return records
+
+    def export_index(self, path):
+        ''' Export dialogs index to json file '''
+        with open( path, 'w', encoding='utf-8' ) as f:
+            f.write( self.index_to_json() )
+
+    def index_to_json(self) -> str:
+        ''' Return dialogs index in json format, keyed by radio data hash '''
+
+        if not self.dialog_records:
+            self.index_dialogs()
+        index = {
+            'sha256':  hashlib.sha256( self.gcx ).hexdigest(),
+            'dialogs': self.dialog_records,
+        }
+        return json.dumps( index )
+
+    def load_index(self, path) -> bool:
+        ''' Load dialogs index from json file.
+            Return False if there is no index or if it was made from other radio data. '''
+
+        if not os.path.isfile( path ):
+            return False
+        with open( path, 'r', encoding='utf-8' ) as f:
+            index = json.loads( f.read() )
+        if index.get( 'sha256' ) != hashlib.sha256( self.gcx ).hexdigest():
+            return False
+        self.dialog_records = index['dialogs']
+        self.dialog_names = { record['offset']: record['name'] for record in self.dialog_records }
+        return True
+
+    def cache_symbols(self) -> dict:
+        ''' Return data used to decompile radio data besides itself (see DecompCache) '''
+        return {
+            'padding': self.padding,
+            'vox':     [ [ vox_file.name, vox_file.offset ] for vox_file in self.vox_files ],
+        }
+
+    def to_cache(self, dialogs=None) -> dict:
+        ''' Return decompiled dialogs for DecompCache, font glyphs as hex strings '''
+
+        if dialogs is None:
+            dialogs = [ elem['DIALOG'] for elem in self.tree_data ]
+        glyph_table = self.glyph_table or GlyphTable()
+        return {
+            'dialogs':   [ GclNode( dialog, FONTS=[ glyph_table.resolve( font ) for font in dialog['FONTS'] ] )
+                           for dialog in dialogs ],
+            'records':   self.dialog_records,
+            'voice_ids': self.voice_ids,
+        }
+
+    def from_cache(self, entry):
+        ''' Set decompiled dialogs from DecompCache entry '''
 
-    def decomp_block(self, size, callback) -> list:
-        ''' Decompile data block using callback '''
+        self.tree_data = []
+        for dialog in entry['dialogs']:
+            if self.glyph_table is not None:
+                dialog['FONTS'] = self.glyph_table.intern_all( dialog['FONTS'] )
+            self.tree_data.append( GclNode({ 'DIALOG': dialog }) )
+            self.dialog_names[dialog['OFFSET']] = dialog['NAME']
+        self.dialog_records = entry['records']
+        self.voice_ids = entry['voice_ids']
+
+    def find_dialogs(self, name=None, freq=None, offset=None) -> list:
+        ''' Return indexed dialog records matching name, frequency or offset.
+            Offset is the dialog offset in bytes (sector index * 0x800 in gcl calls). '''
+
+        if not self.dialog_records:
+            self.index_dialogs()
+        return [ record for record in self.dialog_records
+                 if ( name is None or record['name'] == name )
+                and ( freq is None or record['freq'] == freq )
+                and ( offset is None or record['offset'] == offset ) ]
+
+    def lookup_dialog(self, name=None, freq=None, offset=None) -> GclNode:
+        ''' Decompile first dialog matching name, frequency or offset, None if not found '''
+
+        records = self.find_dialogs( name, freq, offset )
+        if not records:
+            return None
+        dialog = self.decompile_dialog( records[0] )
+        dialog['NAME'] = records[0]['name']
+        if self.glyph_table is not None:
+            dialog['FONTS'] = self.glyph_table.intern_all( dialog['FONTS'] )
+        return dialog
+
+    def decompile_dialogs(self, records, workers=1):
+        ''' Yield decompiled dialogs in order.
+            Dialogs are decoded by a pool of worker processes if workers > 1. '''
+
+        if workers <= 1:
+            yield from map( self.decompile_dialog, records )
+            return
+
+        # Workers only need voice names and block indexes.
+        vox_files = [ DatFile( vox_file.name, vox_file.offset, b'' ) for vox_file in self.vox_files ]
+        chunk_size = max( 1, len( records ) // ( workers * 4 ) )
+        chunks = [ records[i:i+chunk_size] for i in range( 0, len( records ), chunk_size ) ]
+        with ProcessPoolExecutor( max_workers=workers,
+                                  initializer=init_dialog_worker,
+                                  initargs=( bytes( self.gcx ), vox_files ) ) as executor:
+            for dialogs in executor.map( decompile_dialogs, chunks ):
+                for dialog, voice_id in dialogs:
+                    self.voice_ids[dialog['OFFSET']] = voice_id
+                    yield dialog
+
+    def scan_dialogs(self) -> list:
+        ''' Find all dialogs without decoding their data '''
+
+        records = []
+        offset = 0
+        while offset < len( self.gcx ):
+            record = self.scan_dialog( offset )
+            records.append( record )
+            offset = record['end_offset']
+        return records
+
+    def scan_dialog(self, offset) -> dict:
+        ''' Read dialog header and font glyphs, skipping dialog data '''
+
+        self.gcx.offset = offset
+
+        frequency = self.gcx.read_short()
+        # In game, face size and offset is read as int and splitted with binary operations.
+        face_size = self.gcx.read_byte()
+        self.gcx.offset += 1
+        face_offset = self.gcx.read_short()
+        flags = self.gcx.read_short() # Always 0
+
+        # Dialog data need to be processed after fonts so we save offset.
+        data_offset = self.gcx.offset
+        data_size = self.gcx.read_short( self.gcx.offset + 1 )
+        self.gcx.offset += data_size + 1
+
+        # All fonts glyphs ends with three 0's except one font that ends with 001400.
+        fonts_offset = self.gcx.offset
+        self.gcx.read_glyphs()
+
+        if self.padding:
+            self.gcx.offset += ( 0x800 - ( self.gcx.offset % 0x800 ) )
+
+        return {
+            'offset':       offset,
+            'freq':         frequency,
+            'face_size':    face_size,
+            'face_offset':  face_offset,
+            'flags':        flags,
+            'data_offset':  data_offset,
+            'fonts_offset': fonts_offset,
+            'end_offset':   self.gcx.offset,
+        }
+
+    def scan_voice_id(self, record) -> int:
+        ''' Return the highest voice id of a dialog found by scan_dialog().
+            Dialog data is walked without decoding it: blocks are entered or
+            skipped using their size, only GCL conditions are decoded. '''
+
+        voice_id = -1
+        self.gcx.offset = record['data_offset']
+        while self.gcx.offset < record['fonts_offset']:
+            code = self.gcx.read_byte()
+            # Block ends and 'if' block parts
+            if code in ( 0, ENDLINE_CODE, ELSE_CODE ):
+                continue
+            if code == ELSEIF_CODE:
+                decode( self.gcl_decomp.decode_node )
+                continue
+            if code == RANDSWITCH_CASE_CODE:
+                self.gcx.offset += 2
+                continue
+
+            end_offset = self.gcx.offset + self.gcx.read_short()
+            if code == VOICE_CODE:
+                voice_code = self.voice_id( self.voice_name( self.gcx.read_int() ) )
+                if voice_id == -1 or voice_id < voice_code:
+                    voice_id = voice_code
+            elif code == IF_CODE:
+                decode( self.gcl_decomp.decode_node )
+            elif code == RANDSWITCH_CODE:
+                self.gcx.offset += 2
+            elif code != RD_SCRIPT_CODE:
+                self.gcx.offset = end_offset
+        return voice_id
+
+    def decompile_dialog(self, record) -> GclNode:
+        ''' Decompile dialog found by scan_dialog() '''
+
+        self.gcx.offset = record['fonts_offset']
+        fonts = self.gcx.read_glyphs()
+        self.current_fonts = fonts
+        self.gcx.offset = record['data_offset']
+        self.dialog_voice_id = -1
+        dialog_data = self.decompile()
+        self.voice_ids[record['offset']] = self.dialog_voice_id
+
+        return GclNode({
+            'OFFSET':      record['offset'], # Shouldn't be needed.
+            'FREQ':        record['freq'],
+            'FACE_SIZE':   record['face_size'],
+            'FACE_OFFSET': record['face_offset'],
+            'FLAGS':       record['flags'],
+            'DATA':        dialog_data,
+            'FONTS':       fonts,
+            'NAME':        'rd_%03d' % ( int(record['offset'] / 0x800) )
+        })
+
+    def decomp_block(self, size, decode_node) -> list:
+        ''' Decompile data block using node decoder (decoding frame) '''
 
         data = []
         end_offset = self.gcx.offset + size
         while self.gcx.offset < end_offset:
-            data.append( callback() )
+            data.append( (yield decode_node) )
         return data
 
     def decompile(self) -> GclNode:
         ''' Build json tree AST from radio data '''
 
-        radio_code = self.gcx.read_byte()
+        return decode( self.decode_node )
 
-        if radio_code == RadioCode.ENDLINE.value:
-            return GclNode({ RadioCode( radio_code ).name: 0 })
+    def decode_node(self):
+        ''' Read one node, return it or the frame decoding its children '''
 
-        size = self.gcx.read_short() - 2
+        radio_code = self.gcx.read_byte()
 
-        match radio_code:
+        if radio_code == ENDLINE_CODE:
+            return GclNode({ ENDLINE_NAME: 0 })
 
-            case RadioCode.TALK.value:
-                chara = self.gcx.read_short()
-                anim = self.gcx.read_short()
-                unk = self.gcx.read_short()
-                text = self.gcx.read_string( fonts=self.current_fonts )
-                value = [ chara, anim, unk, text ]
+        size = self.gcx.read_short() - 2
 
-            case RadioCode.VOICE.value:
+        decoder = self.decoders.get( radio_code )
+        if decoder is None:
+            print(f'Error: unexpected radio code (RadioCode: {radio_code}, offset: {hex(self.gcx.offset)})')
+            sys.exit(1)
+
+        value = decoder( self, size )
+        hooks = self.hooks.get( radio_code )
+        if type( value ) is GeneratorType:
+            if hooks:
+                return hooked_frame( value, hooks )
+            return value
+        if hooks:
+            for hook in hooks:
+                hook( RADIO_CODE_NAMES[ radio_code ], value )
+        return GclNode({ RADIO_CODE_NAMES[ radio_code ]: value })
+
+    def decode_talk(self, size):
+        ''' Decode TALK data '''
+        chara = self.gcx.read_short()
+        anim = self.gcx.read_short()
+        unk = self.gcx.read_short()
+        text = self.gcx.read_string( fonts=self.current_fonts )
+        return [ chara, anim, unk, text ]
+
+    def decode_voice(self, size):
+        ''' Decode VOICE block (decoding frame) '''
+
+        voice_name = self.voice_name( self.gcx.read_int() )
+        voice_data = yield from self.decomp_block( size - 4, self.decode_node )
+        return GclNode({ VOICE_NAME: GclNode({ voice_name: voice_data }) })
+
+    def decode_anim(self, size):
+        ''' Decode ANIM data '''
+        chara = self.gcx.read_short()
+        anim = self.gcx.read_short()
+        unk = self.gcx.read_short()
+        return [ chara, anim, unk ]
+
+    def decode_add_contact(self, size):
+        ''' Decode ADD_CONTACT data '''
+        frequency = str( self.gcx.read_short() )
+        name = self.gcx.read_string()
+        return GclNode({ frequency: name })
+
+    def decode_gcl_block(self, size, radio_name):
+        ''' Decode gcl data block ending with null byte (decoding frame) '''
+        value = yield from self.decomp_block( size - 1, self.gcl_decomp.decode_node )
+        if self.gcx.read_byte() != 0:
+            print('Error: %s expected null' % radio_name)
+            sys.exit(1)
+        return GclNode({ radio_name: value })
+
+    def decode_memsave(self, size):
+        ''' Decode MEMSAVE data '''
+        return self.decode_gcl_block( size, RadioCode.MEMSAVE.name )
+
+    def decode_prompt(self, size):
+        ''' Decode PROMPT data '''
+        return self.decode_gcl_block( size, RadioCode.PROMPT.name )
+
+    def decode_varsave(self, size):
+        ''' Decode VARSAVE data '''
+        return self.decode_gcl_block( size, RadioCode.VARSAVE.name )
+
+    def decode_sound(self, size):
+        ''' Decode SOUND data '''
+        return self.gcx.read_hex_string( size )
+
+    def decode_if(self, size):
+        ''' Decode IF block with its ELSEIF and ELSE blocks (decoding frame) '''
 
-                voice_code = self.gcx.read_int()
-                # PC VOX filename
-                if voice_code >> 24 == 0xfc:
-                    voice_name = 'vc%06x' % ( voice_code & 0xffffff )
-                # PSX VOX offset in VOX.DAT
-                else:
-                    voice_name = next((vox_file.name for vox_file in self.vox_files if vox_file.block_index == voice_code), '')
-                    if voice_name == '':
-                        print('Error: could not resolve voice code', hex(voice_code))
-                        sys.exit(1)
-                voice_data = self.decomp_block( size - 4, self.decompile )
-                value = GclNode({ voice_name: voice_data })
-
-            case RadioCode.ANIM.value:
-                chara = self.gcx.read_short()
-                anim = self.gcx.read_short()
-                unk = self.gcx.read_short()
-                value = [ chara, anim, unk ]
-
-            case RadioCode.ADD_CONTACT.value:
-                frequency = str( self.gcx.read_short() )
-                name = self.gcx.read_string()
-                value = GclNode({ frequency: name })
-
-            case RadioCode.MEMSAVE.value:
-                value = self.decomp_block( size - 1, self.gcl_decomp.decompile_gcx )
-                if self.gcx.read_byte() != 0:
-                    print('Error: MEMSAVE expected null')
-                    sys.exit(1)
-
-            case RadioCode.SOUND.value:
-                value = self.gcx.read_hex_string( size )
-
-            case RadioCode.PROMPT.value:
-                value = self.decomp_block( size - 1, self.gcl_decomp.decompile_gcx )
-                if self.gcx.read_byte() != 0:
-                    print('Error: PROMPT expected null')
-                    sys.exit(1)
-
-            case RadioCode.VARSAVE.value:
-                value = self.decomp_block( size - 1, self.gcl_decomp.decompile_gcx )
-                if self.gcx.read_byte() != 0:
-                    print('Error: VARSAVE expected null')
-                    sys.exit(1)
-
-            case RadioCode.IF.value:
-                end_offset = self.gcx.offset + size
-                value = []
-                value.append( self.gcl_decomp.decompile_gcx() )
-                value.append( self.decompile() )
-                while self.gcx.offset < end_offset - 1:
-                    arg_value = []
-                    code  = self.gcx.read_byte()
-                    match code:
-                        case RadioCode.ELSEIF.value:
-                            arg_value.append( self.gcl_decomp.decompile_gcx() )
-                            arg_value.append( self.decompile() )
-                            value.append( GclNode({ RadioCode( code ).name: arg_value }) )
-                        case RadioCode.ELSE.value:
-                            arg_value.append( self.decompile() )
-                            value.append( GclNode({ RadioCode( code ).name: arg_value }) )
-                        case _:
-                            self.gcx.offset -= 1
-                            value.append( self.decompile() )
-
-                if self.gcx.read_byte() != 0:
-                    print('Error: IF expected null', hex(self.gcx.offset))
-                    sys.exit(1)
-
-            case RadioCode.SWITCH.value:
-
-                # Not yet implemented, never used by the game anyway...
-                #match code:
-                #    case RadioCode.SWITCH_CASE.value:
-                #    case RadioCode.SWITCH_DEFAULT.value:
-                pass
+        end_offset = self.gcx.offset + size
+        value = []
+        value.append( (yield self.gcl_decomp.decode_node) )
+        value.append( (yield self.decode_node) )
+        while self.gcx.offset < end_offset - 1:
+            arg_value = []
+            code  = self.gcx.read_byte()
+            if code == ELSEIF_CODE:
+                arg_value.append( (yield self.gcl_decomp.decode_node) )
+                arg_value.append( (yield self.decode_node) )
+                value.append( GclNode({ ELSEIF_NAME: arg_value }) )
+            elif code == ELSE_CODE:
+                arg_value.append( (yield self.decode_node) )
+                value.append( GclNode({ ELSE_NAME: arg_value }) )
+            else:
+                self.gcx.offset -= 1
+                value.append( (yield self.decode_node) )
 
-            case RadioCode.RANDSWITCH.value:
+        if self.gcx.read_byte() != 0:
+            print('Error: IF expected null', hex(self.gcx.offset))
+            sys.exit(1)
+        return GclNode({ IF_NAME: value })
 
-                end_offset = self.gcx.offset + size
-                switch_value = str( self.gcx.read_short() )
-                switch_cases = []
-                while self.gcx.offset < end_offset - 1:
-                    if self.gcx.read_byte() != RadioCode.RANDSWITCH_CASE.value:
-                        print('Error: Unexpected code in randswitch',
-                              hex(self.gcx.offset), end_offset - self.gcx.offset )
-                        sys.exit(1)
-                    case_value = str( self.gcx.read_short() )
-                    case_data = self.decompile()
-                    switch_cases.append( GclNode({ case_value: case_data }) )
-                if self.gcx.read_byte() != 0:
-                    print('Error: Missing null after radio randswitch block')
-                    sys.exit()
-                value = GclNode({ switch_value: switch_cases })
+    def decode_switch(self, size):
+        ''' Decode SWITCH block '''
 
-            case RadioCode.EVAL.value:
+        # Not yet implemented, never used by the game anyway...
+        #match code:
+        #    case RadioCode.SWITCH_CASE.value:
+        #    case RadioCode.SWITCH_DEFAULT.value:
+        print(f'Error: unexpected radio code (RadioCode: {RadioCode.SWITCH.value}, offset: {hex(self.gcx.offset)})')
+        sys.exit(1)
 
-                value = self.gcl_decomp.decompile_gcx()
+    def decode_randswitch(self, size):
+        ''' Decode RANDSWITCH block (decoding frame) '''
 
-            case RadioCode.RD_SCRIPT.value:
+        end_offset = self.gcx.offset + size
+        switch_value = str( self.gcx.read_short() )
+        switch_cases = []
+        while self.gcx.offset < end_offset - 1:
+            if self.gcx.read_byte() != RANDSWITCH_CASE_CODE:
+                print('Error: Unexpected code in randswitch',
+                      hex(self.gcx.offset), end_offset - self.gcx.offset )
+                sys.exit(1)
+            case_value = str( self.gcx.read_short() )
+            case_data = yield self.decode_node
+            switch_cases.append( GclNode({ case_value: case_data }) )
+        if self.gcx.read_byte() != 0:
+            print('Error: Missing null after radio randswitch block')
+            sys.exit()
+        return GclNode({ RANDSWITCH_NAME: GclNode({ switch_value: switch_cases }) })
+
+    def decode_eval(self, size):
+        ''' Decode EVAL gcl expression (decoding frame) '''
+        value = yield self.gcl_decomp.decode_node
+        return GclNode({ EVAL_NAME: value })
+
+    def decode_script(self, size):
+        ''' Decode RD_SCRIPT block (decoding frame) '''
+        value = yield from self.decomp_block( size - 1, self.decode_node )
+        if self.gcx.read_byte() != 0:
+            print('Error: Missing null after radio script block')
+            sys.exit()
+        return GclNode({ RD_SCRIPT_NAME: value })
+
+    # Opcode to decoder table, filled once the class is defined.
+    # Leaf decoders return the node value, the others return a decoding frame.
+    decoders = {}
 
-                value = self.decomp_block( size - 1, self.decompile )
-                if self.gcx.read_byte() != 0:
-                    print('Error: Missing null after radio script block')
-                    sys.exit()
+    def decomp_script(self, node) -> str:
+        ''' Return tree data converted to gcl script '''
 
-            case RadioCode.ENDLINE.value:
+        writer = ScriptWriter()
+        self.write_script( node, writer )
+        return writer.getvalue()
 
-                value = '\n'
+    def write_script(self, node, writer):
+        ''' Write tree data as gcl script '''
 
-            case _:
-                print(f'Error: unexpected radio code (RadioCode: {radio_code}, offset: {hex(self.gcx.offset)})')
-                sys.exit(1)
+        if isinstance(node, list):
+            for elem in node:
+                self.write_script( elem, writer )
+            return
 
-        return GclNode({ RadioCode( radio_code ).name: value })
+        node_type, value = node.get()
 
-    def indent_text(self, text) -> str:
-        ''' Indent text block '''
+        match node_type:
 
-        return textwrap.indent( text, 4 * ' ' )
+            case RadioCode.RD_SCRIPT.name:
 
-    def decomp_script(self, node) -> str:
-        ''' Return tree data converted to gcl script '''
+                writer.write( '{' )
+                writer.indent()
+                for command in value:
+                    self.write_script( command, writer )
+                writer.dedent()
+                writer.write( '\n}' )
+                return
 
-        s = ''
+            case RadioCode.ENDLINE.name:
 
-        if isinstance(node, list):
-            for elem in node:
-                s += self.decomp_script( elem )
-            return s
+                writer.write( '\n' )
+                return
 
-        node_type, value = node.get()
+        writer.write( '%s ' % RadioCode[node_type].name.lower() )
 
         match node_type:
 
             case RadioCode.TALK.name:
 
-                s += '%04X %04X %d "%s"' % ( value[0], value[1], value[2], value[3] )
+                writer.write( '%04X %04X %d "%s"' % ( value[0], value[1], value[2], value[3] ) )
 
             case RadioCode.VOICE.name:
 
                 voice_code, voice_data = value.get()
-                s += '%s ' % ( str(voice_code) )
-                s += self.decomp_script( voice_data )
+                writer.write( '%s ' % ( str(voice_code) ) )
+                self.write_script( voice_data, writer )
 
             case RadioCode.ANIM.name:
 
-                s += '%04X %04X %d' % ( value[0], value[1], value[2] )
+                writer.write( '%04X %04X %d' % ( value[0], value[1], value[2] ) )
 
             case RadioCode.ADD_CONTACT.name:
 
                 contact_freq, contact_name = value.get()
-                s += '%.3f %s' % ( int( contact_freq ) / 100, contact_name )
+                writer.write( '%.3f %s' % ( int( contact_freq ) / 100, contact_name ) )
 
             case RadioCode.MEMSAVE.name:
 
                 for val in value:
-                    s += '%s' % ( self.gcl_decomp.decomp_script( val ) )
+                    self.gcl_decomp.write_script( val, writer )
 
             case RadioCode.SOUND.name:
 
-                s += '%s' % ( value )
+                writer.write( '%s' % ( value ) )
 
             case RadioCode.PROMPT.name:
 
-                s += '%s %s' % ( self.gcl_decomp.decomp_script( value[0] ),
-                                 self.gcl_decomp.decomp_script( value[1] ) )
+                self.gcl_decomp.write_script( value[0], writer )
+                writer.write( ' ' )
+                self.gcl_decomp.write_script( value[1], writer )
 
             case RadioCode.VARSAVE.name:
 
                 for variable in value:
-                    s += '%s' % ( self.gcl_decomp.decomp_script( variable ) )
+                    self.gcl_decomp.write_script( variable, writer )
 
             case RadioCode.IF.name:
 
-                s += '%s ' % ( self.gcl_decomp.decomp_script( value[0] ) )
+                self.gcl_decomp.write_script( value[0], writer )
+                writer.write( ' ' )
                 for elem in value[1:]:
-                    s += '%s' % ( self.decomp_script( elem ) )
+                    self.write_script( elem, writer )
 
             case RadioCode.ELSE.name:
 
-                s += self.decomp_script( value )
+                self.write_script( value, writer )
 
             case RadioCode.ELSEIF.name:
 
-                s += '%s ' % ( self.gcl_decomp.decomp_script( value[0] ) )
-                s += self.decomp_script( value[1] )
+                self.gcl_decomp.write_script( value[0], writer )
+                writer.write( ' ' )
+                self.write_script( value[1], writer )
 
             case RadioCode.SWITCH.name:
 
@@ -411,28 +714,52 @@ class RadioDecomp():
             case RadioCode.RANDSWITCH.name:
 
                 switch_value, switch_cases = value.get()
-                s += '%d:\n' % ( int( switch_value ) )
+                writer.write( '%d:\n' % ( int( switch_value ) ) )
                 for case in switch_cases:
                     case_value, case_data = case.get()
-                    case_str = 'case %d: %s\n' % ( int( case_value ), self.decomp_script( case_data ) )
-                    s += self.indent_text( case_str )
+                    writer.indent()
+                    writer.write( 'case %d: ' % int( case_value ) )
+                    self.write_script( case_data, writer )
+                    writer.write( '\n' )
+                    writer.dedent()
 
             case RadioCode.EVAL.name:
 
-                s += '%s' % ( self.gcl_decomp.decomp_script( value ) )
-
-            case RadioCode.RD_SCRIPT.name:
-
-                script = ''
-                for command in value:
-                    script += self.decomp_script( command )
-
-                s += '{' + self.indent_text( script ) + '\n}'
-                return s
-
-            case RadioCode.ENDLINE.name:
-
-                s += '\n'
-                return s
-
-        return '%s %s' % ( RadioCode[node_type].name.lower(), s )
+                self.gcl_decomp.write_script( value, writer )
+
+RadioDecomp.decoders.update({
+    RadioCode.TALK.value:        RadioDecomp.decode_talk,
+    RadioCode.VOICE.value:       RadioDecomp.decode_voice,
+    RadioCode.ANIM.value:        RadioDecomp.decode_anim,
+    RadioCode.ADD_CONTACT.value: RadioDecomp.decode_add_contact,
+    RadioCode.MEMSAVE.value:     RadioDecomp.decode_memsave,
+    RadioCode.SOUND.value:       RadioDecomp.decode_sound,
+    RadioCode.PROMPT.value:      RadioDecomp.decode_prompt,
+    RadioCode.VARSAVE.value:     RadioDecomp.decode_varsave,
+    RadioCode.IF.value:          RadioDecomp.decode_if,
+    RadioCode.SWITCH.value:      RadioDecomp.decode_switch,
+    RadioCode.RANDSWITCH.value:  RadioDecomp.decode_randswitch,
+    RadioCode.EVAL.value:        RadioDecomp.decode_eval,
+    RadioCode.RD_SCRIPT.value:   RadioDecomp.decode_script,
+})
+
+# Radio decompiler of a worker process
+worker_radio = None
+
+def init_dialog_worker(data, vox_files):
+    ''' Create the radio decompiler of a worker process '''
+    global worker_radio
+    worker_radio = RadioDecomp( GcxData( data ), vox_files=vox_files, eager=False )
+
+def decompile_dialogs(records) -> list:
+    ''' Decompile dialogs with their voice id (worker process) '''
+
+    dialogs = []
+    for record in records:
+        dialogs.append( ( worker_radio.decompile_dialog( record ), worker_radio.voice_ids[record['offset']] ) )
+    return dialogs
+
+def render_dialog(dialog) -> str:
+    ''' Return dialog script (worker process) '''
+
+    return RadioDecomp( GcxData(), eager=False ).render_dialog( dialog )
@@ -0,0 +1,98 @@
+''' Task graph scheduler '''
+import sys
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class TaskGraph():
+    ''' Tasks run by worker threads as soon as the tasks they depend on are done.
+
+        Threads only overlap file reads and writes, and waiting on worker
+        processes: CPU bound tasks (decoding, compiling) still run one at a
+        time and need a process pool to run in parallel.
+
+        A task function gets the results of its dependencies as arguments, in
+        the order they were given. Tasks must be added after their
+        dependencies, so with a single worker they run in the order they
+        were added. '''
+
+    def __init__(self, workers=4) -> None:
+
+        self.workers = workers
+        self.tasks = {}
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, func, deps=()) -> str:
+        ''' Add task running func once deps (task names) are done, return its name '''
+
+        if name in self.tasks:
+            print( 'Error: task "%s" added twice' % name )
+            sys.exit(1)
+        for dep in deps:
+            if dep not in self.tasks:
+                print( 'Error: task "%s" depends on unknown task "%s"' % (name, dep) )
+                sys.exit(1)
+        self.tasks[name] = ( func, tuple( deps ) )
+        return name
+
+    def result(self, name):
+        ''' Return result of a done task '''
+        return self.results[name]
+
+    def run(self):
+        ''' Run all tasks, an error in a task is raised once running tasks are done
+            (other tasks are not started) '''
+
+        if self.workers <= 1:
+            for name in self.tasks:
+                self.run_task( name )
+            return
+
+        waiting = { name: set( deps ) for name, ( _func, deps ) in self.tasks.items() }
+        dependents = { name: [] for name in self.tasks }
+        for name, ( _func, deps ) in self.tasks.items():
+            for dep in set( deps ):
+                dependents[dep].append( name )
+
+        # Ready tasks with the longest chain of dependents go first (then in
+        # added order), only as many as there are workers are submitted.
+        chain = {}
+        for name in reversed( list( self.tasks ) ):
+            chain[name] = 1 + max( ( chain[dependent] for dependent in dependents[name] ), default=0 )
+        order = { name: index for index, name in enumerate( self.tasks ) }
+        ready = []
+        def set_ready(names):
+            for name in names:
+                del waiting[name]
+                heapq.heappush( ready, ( -chain[name], order[name], name ) )
+
+        executor = ThreadPoolExecutor( max_workers=self.workers )
+        running = {}
+        try:
+            set_ready( [ name for name, deps in waiting.items() if not deps ] )
+            while ready or running:
+                while ready and len( running ) < self.workers:
+                    _chain, _order, name = heapq.heappop( ready )
+                    running[executor.submit( self.run_task, name )] = name
+                done, _pending = wait( running, return_when=FIRST_COMPLETED )
+                for future in done:
+                    name = running.pop( future )
+                    if future.exception() is not None:
+                        raise future.exception()
+                    for dependent in dependents[name]:
+                        waiting[dependent].discard( name )
+                    set_ready( [ dependent for dependent in dependents[name] if not waiting[dependent] ] )
+        finally:
+            # On error or interruption, tasks not started yet are dropped.
+            executor.shutdown( wait=True, cancel_futures=True )
+
+    #---------------------------------------------------------------------------
+
+    def run_task(self, name):
+        ''' Run task with results of its dependencies '''
+
+        func, deps = self.tasks[name]
+        result = func( *[ self.results[dep] for dep in deps ] )
+        with self.lock:
+            self.results[name] = result
@@ -0,0 +1,135 @@
+''' Write indented script text '''
+
+# Line boundaries used by str.splitlines()
+LINE_BREAKS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+INDENT = 4 * ' '
+
+class ScriptWriter():
+    ''' Write script text with indented regions in linear time.
+
+        Gives the same text as indenting every rendered region with
+        textwrap.indent: every line of a region having non whitespace
+        characters is prefixed, even when the region starts mid-line.
+        Whitespaces and line breaks after the last written character are kept
+        pending with the indent marks (region depth) of each line start, so
+        they can still be stripped or retracted. '''
+
+    def __init__(self, stream=None) -> None:
+
+        # Text stream, list of chunks or internal list
+        self.chunks = []
+        if stream is None:
+            self.write_out = self.chunks.append
+        elif isinstance( stream, list ):
+            self.write_out = stream.append
+        else:
+            self.write_out = stream.write
+        self.last = ''
+        self.pending = []
+        self.depth = 0
+
+    def write(self, text):
+        ''' Write text into current region '''
+
+        pending = self.pending
+
+        # Fast path, no line break
+        if text.isprintable():
+            core = text.rstrip()
+            if core:
+                if pending:
+                    self.flush()
+                if self.last:
+                    self.write_out( self.last )
+                self.last = core
+                if len( core ) != len( text ):
+                    pending.append( text[len( core ):] )
+            elif text:
+                pending.append( text )
+            return
+
+        for line in text.splitlines( True ):
+            body = line.rstrip( LINE_BREAKS )
+            core = body.rstrip()
+            if core:
+                if pending:
+                    self.flush()
+                if self.last:
+                    self.write_out( self.last )
+                self.last = core
+                if len( core ) != len( body ):
+                    pending.append( body[len( core ):] )
+            elif body:
+                pending.append( body )
+            if len( body ) != len( line ):
+                pending.append( line[len( body ):] )
+                pending.extend( range( 1, self.depth + 1 ) )
+
+    def indent(self):
+        ''' Start an indented region '''
+        self.depth += 1
+        self.pending.append( self.depth )
+
+    def dedent(self):
+        ''' End current indented region '''
+        if self.depth in self.pending:
+            self.pending[:] = [ elem for elem in self.pending if elem != self.depth ]
+        self.depth -= 1
+
+    def flush(self):
+        ''' Write pending text, indenting marks of the current line '''
+
+        pending = self.pending
+        line_start = 0
+        for index in range( len( pending ) - 1, -1, -1 ):
+            elem = pending[index]
+            if type( elem ) is str and elem[0] in LINE_BREAKS:
+                line_start = index + 1
+                break
+
+        text = ''
+        for index, elem in enumerate( pending ):
+            if type( elem ) is str:
+                text += elem
+            elif index >= line_start:
+                text += INDENT
+        pending.clear()
+
+        if self.last:
+            self.write_out( self.last )
+        self.last = text
+
+    def rstrip(self):
+        ''' Remove trailing whitespaces and line breaks '''
+        self.pending.clear()
+
+    def retract(self):
+        ''' Remove the last written character '''
+
+        pending = self.pending
+        for index in range( len( pending ) - 1, -1, -1 ):
+            elem = pending[index]
+            if type( elem ) is not str:
+                continue
+            if elem[0] in LINE_BREAKS:
+                # Line start marks of the removed line break go with it
+                del pending[index:]
+            elif len( elem ) > 1:
+                pending[index] = elem[:-1]
+            else:
+                del pending[index]
+            return
+        self.last = self.last[:-1]
+
+    def close(self):
+        ''' Write remaining text '''
+
+        self.write_out( self.last + ''.join( elem for elem in self.pending if type( elem ) is str ) )
+        self.last = ''
+        self.pending.clear()
+
+    def getvalue(self) -> str:
+        ''' Return written text (when no stream was given) '''
+
+        self.close()
+        return ''.join( self.chunks )
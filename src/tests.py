@@ -1,6 +1,8 @@
 import os
 import sys
+import shutil
 import hashlib
+import tempfile
 from timeit import default_timer as timer
 
 from gcl_decompile import GclDecomp
@@ -8,15 +10,20 @@ from gcl_compile import GclComp
 from radio_decompile import RadioDecomp
 from radio_compile import RadioComp
 from gcx import GcxData
-from voice_unpacker import VoiceUnpacker
+from voice_unpacker import VoiceUnpacker, EMPTY_VOX_NAME
 from demo_unpacker import DemoUnpacker
+from file_io import PrefetchReader, list_files
 
 class Test():
     ''' Test if recompiled gcx files matches '''
 
-    def __init__(self) -> None:
+    def __init__(self, cache=None, read_ahead=4) -> None:
 
         self.start_time = timer()
+        # Decompiled data cache (see DecompCache)
+        self.cache = cache
+        # Number of stage files read ahead (see PrefetchReader)
+        self.read_ahead = read_ahead
         self.total_files_tested = 0
         self.total_bytes_matched = 0
         self.total_success = 0
@@ -74,10 +81,16 @@ class Test():
             voice_recomp.pack( voice_decomp.vox_files )
             success = self.isMatching( voice_decomp, voice_recomp )
             print('\033[%sm%.1f %s\033[0m' % ('92' if success else '91', self.elapsed(), vox_path))
+            # Patch vox files in a copy of VOX.DAT
+            print('%.1f Patching %s...' % (self.elapsed(), os.path.basename(vox_path)))
+            success = self.test_vox_patch( vox_path, vox_files )
+            print('\033[%sm%.1f %s (patch)\033[0m' % ('92' if success else '91', self.elapsed(), vox_path))
+            self.total_success += int(success)
+            self.total_files_tested += 1
 
         # Decompile RADIO.DAT
         print('%.1f Decompiling %s...' % (self.elapsed(), os.path.basename(radio_path)))
-        radio_decomp = RadioDecomp( GcxData( radio_path ), padding=self.padding, vox_files=vox_files )
+        radio_decomp = self.decompile_radio( radio_path, vox_files )
 
         # Recompile radio data
         radio_comp = RadioComp( padding=self.padding, vox_files=vox_files )
@@ -89,19 +102,77 @@ class Test():
         self.total_files_tested += 1
 
         # Decompile GCX files from stage directory
-        for subdir, dirs, files in os.walk( stage_path ):
-            for file in files:
-                if file.endswith( '.gcx' ):
-                    gcx_file = os.path.join( subdir, file )
-                    decomp = GclDecomp( GcxData( gcx_file ), radio=radio_decomp, vox_files=vox_files, demo_files=demo_files )
-                    decomp.decompile_gcx_file()
-                    recomp = GclComp( radio=radio_comp, vox_files=vox_files, demo_files=demo_files )
-                    # Recompile gcl data
-                    recomp.compile_gcl_file( decomp.tree_data )
-                    success = self.isMatching( decomp, recomp )
-                    print('\033[%sm%.1f %s\033[0m' % ('92' if success else '91', self.elapsed(), gcx_file))
-                    self.total_success += int(success)
-                    self.total_files_tested += 1
+        stage_files = list_files( stage_path, '.gcx' )
+        for gcx_file, gcx_data in PrefetchReader( stage_files, depth=self.read_ahead ):
+            decomp = GclDecomp( GcxData( gcx_data ), radio=radio_decomp, vox_files=vox_files, demo_files=demo_files )
+            if self.cache is None:
+                decomp.decompile_gcx_file()
+            else:
+                self.cache.decompile( decomp, decomp.decompile_gcx_file )
+            recomp = GclComp( radio=radio_comp, vox_files=vox_files, demo_files=demo_files )
+            # Recompile gcl data
+            recomp.compile_gcl_file( decomp.tree_data )
+            success = self.isMatching( decomp, recomp )
+            print('\033[%sm%.1f %s\033[0m' % ('92' if success else '91', self.elapsed(), gcx_file))
+            self.total_success += int(success)
+            self.total_files_tested += 1
+
+    def decompile_radio(self, radio_path, vox_files) -> RadioDecomp:
+        ''' Decompile radio file, or load it from cache '''
+
+        if self.cache is None:
+            return RadioDecomp( GcxData( radio_path ), padding=self.padding, vox_files=vox_files )
+        radio_decomp = RadioDecomp( GcxData( radio_path ), padding=self.padding, vox_files=vox_files, eager=False )
+        def decompile():
+            radio_decomp.decompile_radio_file()
+            radio_decomp.resolve_dialog_filenames()
+        self.cache.decompile( radio_decomp, decompile )
+        return radio_decomp
+
+    def test_vox_patch(self, vox_path, vox_files) -> bool:
+        ''' Patch vox files in place and moved to the end of a VOX.DAT copy,
+            then check that unpacked vox files match '''
+
+        if len( vox_files ) < 2:
+            return True
+        temp_dir = tempfile.mkdtemp()
+        try:
+            vox_dat = os.path.join( temp_dir, 'VOX.DAT' )
+            shutil.copyfile( vox_path, vox_dat )
+            expected = { vox_file.name: bytes( vox_file.data ) for vox_file in vox_files }
+
+            # Smaller data rewritten in place, patched by name again after unpacking
+            name = vox_files[1].name
+            expected[name] = expected[name][:len( expected[name] ) // 2] + b'\x01'
+            VoiceUnpacker().patch( vox_dat, name, expected[name] )
+            expected[name] += b'\x02'
+            moved = VoiceUnpacker().patch( vox_dat, name, expected[name] )
+            if moved or not self.isMatchingVox( vox_dat, expected ):
+                return False
+
+            # First vox file moved to the end, an empty one is left in its place
+            name = vox_files[0].name
+            expected[name] = expected[name] * 3
+            moved = VoiceUnpacker().patch( vox_dat, name, expected[name] )
+            if name not in moved:
+                return False
+            expected[EMPTY_VOX_NAME] = None
+            return self.isMatchingVox( vox_dat, expected )
+        finally:
+            shutil.rmtree( temp_dir )
+
+    def isMatchingVox(self, vox_dat, expected) -> bool:
+        ''' Check if unpacked vox files match expected data (None matches any data) '''
+
+        vox_files = VoiceUnpacker().unpack( vox_dat )
+        if sorted( vox_file.name for vox_file in vox_files ) != sorted( expected ):
+            print('\033[91mError: patched vox files names do not match\033[0m')
+            return False
+        for vox_file in vox_files:
+            if expected[vox_file.name] is not None and bytes( vox_file.data ) != expected[vox_file.name]:
+                print('\033[91mError: patched vox file %s does not match\033[0m' % vox_file.name)
+                return False
+        return True
 
     def isMatching(self, decomp, recomp, compare=True):
 
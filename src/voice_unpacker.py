@@ -1,8 +1,17 @@
 import hashlib
+import json
 import sys
+import os
 
 from gcx import GcxData, DatFile
 
+# Header of every vox file
+VOX_HEADER = 0x10080000
+# Names of patched vox files, saved next to VOX.DAT (see VoiceUnpacker.patch)
+NAMES_SUFFIX = '.names.json'
+# Vox file left in the sectors of the first vox file when it is moved
+EMPTY_VOX_NAME = 'vcEmpty.vox'
+
 class VoiceUnpacker:
     ''' Unpack/Repack PSX VOX.DAT files using file names found in PC US version '''
 
@@ -16,13 +25,14 @@ class VoiceUnpacker:
         print( 'Unpacking vox: %s' % vox_dat )
         self.gcx = GcxData( vox_dat )
         self.vox_files = []
+        saved_names = self.load_names( vox_dat )
         count = 0
         offset = 0x800
         vox_offset = 0
         unknown_index = 0
         duplicates = {}
         while offset <= len( self.gcx ):
-            if offset == len( self.gcx ) or self.gcx.read_int( offset ) == 0x10080000:
+            if offset == len( self.gcx ) or self.gcx.read_int( offset ) == VOX_HEADER:
                 count += 1
                 last_padding = 4
                 while offset - last_padding >= 0 and self.gcx.read_byte( offset - last_padding ) == 0:
@@ -35,25 +45,30 @@ class VoiceUnpacker:
                 or vox_file_hash == '1597965f6325a52dd49dcc0863b097aa8a249998513ca40e2e8a6fcec024c96f':
                     vox_file_data.append( 0 )
                     vox_file_hash = hashlib.sha256( vox_file_data ).hexdigest()
-                if vox_file_hash in self.pc_voice_files.keys():
-                    vox_name = self.pc_voice_files[vox_file_hash]
+                saved_name = saved_names.get( vox_offset // 0x800 )
+                if saved_name is not None and saved_name[1] == vox_file_hash:
+                    # Patched vox file
+                    vox_name = saved_name[0]
                 else:
-                    # Search for duplicated hash
-                    vox_name = ''
-                    for key in self.pc_voice_files.keys():
-                        if key.startswith( vox_file_hash ):
-                            hash = key[:64]
-                            if not hash in duplicates:
-                                duplicates[hash] = 1
-                            else:
-                                duplicates[hash] += 1
-                            vox_name = self.pc_voice_files['%s_%d' % (hash, duplicates[hash])]
-                            break
-                    if vox_name == '':
-                        print('Warning: could not resolve voice file name for', vox_file_hash)
-                        vox_name = 'vcUnknown%02d' % ( unknown_index )
-                    unknown_index += 1
-                vox_name += '.vox'
+                    if vox_file_hash in self.pc_voice_files.keys():
+                        vox_name = self.pc_voice_files[vox_file_hash]
+                    else:
+                        # Search for duplicated hash
+                        vox_name = ''
+                        for key in self.pc_voice_files.keys():
+                            if key.startswith( vox_file_hash ):
+                                hash = key[:64]
+                                if not hash in duplicates:
+                                    duplicates[hash] = 1
+                                else:
+                                    duplicates[hash] += 1
+                                vox_name = self.pc_voice_files['%s_%d' % (hash, duplicates[hash])]
+                                break
+                        if vox_name == '':
+                            print('Warning: could not resolve voice file name for', vox_file_hash)
+                            vox_name = 'vcUnknown%02d' % ( unknown_index )
+                        unknown_index += 1
+                    vox_name += '.vox'
                 self.vox_files.append( DatFile( vox_name, vox_offset, vox_file_data ) )
                 vox_offset = offset
             offset += ( 0x800 - ( offset % 0x800 ) )
@@ -61,6 +76,18 @@ class VoiceUnpacker:
         print('Total vox files unpacked:', count)
         return self.vox_files
 
+    def plan(self, sizes) -> list:
+        ''' Return vox files (without data) placed in VOX.DAT from ( name, size ) list.
+            Every vox file is followed by 0xf004 and padded to the next sector. '''
+
+        vox_files = []
+        offset = 0
+        for name, size in sizes:
+            vox_files.append( DatFile( name, offset, None ) )
+            offset += size + 2
+            offset += ( 0x800 - ( offset % 0x800 ) )
+        return vox_files
+
     def pack(self, vox_files):
         ''' Pack vox files into VOX.DAT buffer '''
 
@@ -78,6 +105,89 @@ class VoiceUnpacker:
             self.gcx.extend( b'\0' * padding_size )
             count += 1
 
+    def patch(self, vox_dat, name, data, vox_files=None) -> dict:
+        ''' Replace vox file data inside VOX.DAT file without repacking it.
+            The vox file is rewritten in place if it fits in its sectors, otherwise
+            it is moved to the end of VOX.DAT and its previous sectors are cleared
+            (the first vox file is replaced by an empty one, EMPTY_VOX_NAME).
+            VOX.DAT is unpacked first if vox_files are not provided.
+
+            Patched data can't be named from its hash: names of all vox files are
+            saved next to VOX.DAT (NAMES_SUFFIX) and used by unpack(), so the
+            same vox file can be patched again by name.
+            Return moved vox file name with its (old, new) block indexes. '''
+
+        print( 'Patching vox: %s (%s)' % ( vox_dat, name ) )
+        if len( data ) < 4 or GcxData( data ).read_int( 0 ) != VOX_HEADER:
+            print( 'Error: vox file data does not start with vox header', name )
+            sys.exit( 1 )
+        unpacked = vox_files is None
+        if unpacked:
+            vox_files = self.unpack( vox_dat )
+        self.vox_files = vox_files
+
+        vox_file = next( ( vox_file for vox_file in vox_files if vox_file.name == name ), None )
+        if vox_file is None:
+            print( 'Error: vox file not found', name )
+            sys.exit( 1 )
+
+        dat_size = os.path.getsize( vox_dat )
+        end_offset = min( ( other.offset for other in vox_files if other.offset > vox_file.offset ),
+                          default=dat_size )
+        slot_size = end_offset - vox_file.offset
+
+        vox_data = GcxData( data )
+        vox_data.push_short( 0xf004 )
+        vox_data.extend( b'\0' * ( 0x800 - ( len( vox_data ) % 0x800 ) ) )
+
+        moved = {}
+        if len( vox_data ) <= slot_size:
+            writes = [ ( vox_file.offset, vox_data + bytes( slot_size - len( vox_data ) ) ) ]
+        else:
+            # Cleared sectors are read as padding of the previous vox file, the
+            # first one has none: an empty vox file is left in its place.
+            free_slot = bytes( slot_size )
+            if vox_file.offset == 0:
+                empty_data = GcxData()
+                empty_data.push_int( VOX_HEADER )
+                free_slot = bytes( empty_data ) + b'\xf0\x04' + free_slot[6:]
+                vox_files.insert( 0, DatFile( EMPTY_VOX_NAME, 0, empty_data ) )
+            writes = [ ( vox_file.offset, free_slot ), ( dat_size, vox_data ) ]
+            moved[name] = ( vox_file.block_index, dat_size // 0x800 )
+            vox_file.offset = dat_size
+            # Keep vox files in VOX.DAT order.
+            vox_files.remove( vox_file )
+            vox_files.append( vox_file )
+        vox_file.data = GcxData( data )
+        saved_names = { vox_file.block_index: [ vox_file.name, hashlib.sha256( vox_file.data ).hexdigest() ]
+                        for vox_file in vox_files if vox_file.data is not None }
+
+        try:
+            with open( vox_dat, 'r+b' ) as f:
+                for offset, chunk in writes:
+                    f.seek( offset )
+                    f.write( chunk )
+            with open( vox_dat + NAMES_SUFFIX, 'w', encoding='utf-8' ) as f:
+                f.write( json.dumps( { '%d' % block_index: saved_name
+                                       for block_index, saved_name in sorted( saved_names.items() ) }, indent=1 ) )
+        except OSError as err:
+            print( 'Error writing vox file:', err )
+            sys.exit( 1 )
+        if unpacked:
+            for offset, chunk in writes:
+                self.gcx[offset:offset+len( chunk )] = chunk
+        return moved
+
+    def load_names(self, vox_dat) -> dict:
+        ''' Return saved names of vox files { block index: [ name, sha256 ] } '''
+
+        names_path = vox_dat + NAMES_SUFFIX
+        if not os.path.isfile( names_path ):
+            return {}
+        with open( names_path, 'r', encoding='utf-8' ) as f:
+            names = json.loads( f.read() )
+        return { int( block_index ): saved_name for block_index, saved_name in names.items() }
+
     # English voice files from PC version.
     # This list could be extended to contain other languages.
     pc_voice_files = {